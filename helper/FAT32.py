@@ -1,42 +1,143 @@
 from enum import Flag
 from datetime import datetime 
+from array import array
+import struct
+import hashlib
+from collections import OrderedDict
+import bisect
 import re 
+import sys
+from functools import partial
+from .device import open_device
+from .stream import FileContent, ExtentFile
+from .tree import Tree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+def _uint32_view(data):
+    # Zero-copy little-endian view over raw FAT bytes
+    if numpy is not None:
+        return numpy.frombuffer(data, dtype='<u4')
+    if sys.byteorder == 'little':
+        return memoryview(data).cast('I')
+    entries = array('I', data)
+    entries.byteswap()
+    return entries
 
 class FAT:
     EOF_MARKER = 0x0FFFFFFF 
     BAD_CLUSTER = 0x0FFFFFF7
+    # Each page covers 16384 clusters and is only read and decoded when touched
+    PAGE_SIZE = 64 * 1024
+    # Number of start clusters whose extents are kept
+    CHAIN_CACHE_SIZE = 1024
     
-    def __init__(self, fat_data):
-        self.raw_data = fat_data
-        self.entries = []
-        self._parse_fat_entries()
+    def __init__(self, device, offset, size):
+        self.device = device
+        self.offset = offset
+        self.size = size
+        self.entriesPerPage = self.PAGE_SIZE // 4
+        self.pages = {}
+        self.chainCache = OrderedDict()
+
+    def __len__(self):
+        return self.size // 4
+
+    def __getitem__(self, cluster):
+        if not 0 <= cluster < len(self):
+            raise IndexError(f"Cluster {cluster} over index")
+        page, index = divmod(cluster, self.entriesPerPage)
+        entries = self.pages.get(page)
+        if entries is None:
+            entries = self._decode_page(page)
+        return int(entries[index])
     
-    def _parse_fat_entries(self):
+    def _decode_page(self, page):
         # FAT32 using 4 byte for entry 
-        entry_size = 4
-        for i in range(0, len(self.raw_data), entry_size):
-            entry_bytes = self.raw_data[i:i + entry_size]
-            self.entries.append(int.from_bytes(entry_bytes, byteorder='little'))
+        start = page * self.PAGE_SIZE
+        entries = _uint32_view(self.device.view(self.offset + start, min(self.PAGE_SIZE, self.size - start)))
+        self.pages[page] = entries
+        return entries
     
-    def getClustersChain(self, start_cluster):
+    def _run_end(self, cluster):
+        # Last cluster of the contiguous run (n -> n + 1 links) starting at cluster
+        while True:
+            if cluster >= len(self):
+                raise ValueError(f"Cluster {cluster} over index")
+            page, index = divmod(cluster, self.entriesPerPage)
+            entries = self.pages.get(page)
+            if entries is None:
+                entries = self._decode_page(page)
+            base = page * self.entriesPerPage
+            if numpy is not None:
+                # Most runs of a fragmented chain are short, the first entries are looked at one by one
+                # and a longer run is compared in windows that double in size
+                start = min(index + 16, len(entries))
+                for i in range(index, start):
+                    if entries.item(i) != base + i + 1:
+                        return base + i
+                window = 32
+                while start < len(entries):
+                    stop = min(start + window, len(entries))
+                    expected = numpy.arange(base + start + 1, base + stop + 1, dtype=numpy.uint32)
+                    breaks = numpy.flatnonzero(entries[start:stop] != expected)
+                    if len(breaks):
+                        return base + start + int(breaks[0])
+                    start = stop
+                    window *= 2
+            else:
+                for i in range(index, len(entries)):
+                    if entries[i] != base + i + 1:
+                        return base + i
+            cluster = base + len(entries)
+
+    def _walk_extents(self, start_cluster):
         if not isinstance(start_cluster, int) or start_cluster < 0:
             raise ValueError("Cluster negative")
-            
-        cluster_chain = []
+
+        extents = []
+        # sorted (first, last) of every run so far, a chain that re-enters one of them is a loop
+        visited = []
         current_cluster = start_cluster
-        
+
         while True:
-            if current_cluster >= len(self.entries):
-                raise ValueError(f"Cluster {current_cluster} over index")
-            
-            cluster_chain.append(current_cluster)
-            
-            next_cluster = self.entries[current_cluster]
-            
-            if next_cluster in (self.EOF_MARKER, self.BAD_CLUSTER):
-                return cluster_chain
-                
+            last_cluster = self._run_end(current_cluster)
+            i = bisect.bisect_left(visited, (current_cluster,))
+            if (i > 0 and visited[i - 1][1] >= current_cluster) or (i < len(visited) and visited[i][0] <= last_cluster):
+                raise ValueError(f"Cluster chain from {start_cluster} loops at cluster {current_cluster}")
+            visited.insert(i, (current_cluster, last_cluster))
+            extents.append((current_cluster, last_cluster - current_cluster + 1))
+
+            # upper 4 bits are reserved, 0x0FFFFFF8 and above all mark end of chain
+            next_cluster = self[last_cluster] & 0x0FFFFFFF
+            if next_cluster >= self.BAD_CLUSTER:
+                return tuple(extents)
+            if next_cluster < 2:
+                raise ValueError(f"Cluster {last_cluster} links to free cluster")
+
             current_cluster = next_cluster
+
+    def getExtents(self, start_cluster):
+        """Cluster chain as coalesced (start_cluster, run_length) runs"""
+        extents = self.chainCache.get(start_cluster)
+        if extents is not None:
+            self.chainCache.move_to_end(start_cluster)
+            return extents
+
+        extents = self._walk_extents(start_cluster)
+        self.chainCache[start_cluster] = extents
+        if len(self.chainCache) > self.CHAIN_CACHE_SIZE:
+            self.chainCache.popitem(last=False)
+        return extents
+
+    def getClustersChain(self, start_cluster):
+        cluster_chain = []
+        for start, length in self.getExtents(start_cluster):
+            cluster_chain.extend(range(start, start + length))
+        return cluster_chain
 			
 class Attribute(Flag):
 		READ_ONLY = 1      # 0b00000001
@@ -46,134 +147,122 @@ class Attribute(Flag):
 		DIRECTORY = 16     # 0b00010000
 		ARCHIVE = 32       # 0b00100000
 
+# name, extension, attribute, reserved, creation tenths, creation time, creation date,
+# last access date, cluster high, update time, update date, cluster low, size
+DIRECTORY_ENTRY = struct.Struct('<8s3sBBBHHHHHHHI')
+
+def decodeDate(date, time = 0, second = 0):
+	# Zeroed or corrupt fields are not a valid date, such entries simply have none
+	try:
+		return datetime(1980 + (date >> 9), (date >> 5) & 0b1111, date & 0b11111, time >> 11, (time >> 5) & 0b111111, second)
+	except ValueError:
+		return None
+
 class ENTRY:
-	def __init__(self, data):
-		self.data = data
+	__slots__ = ('name', 'extension', 'attr', 'is_subEntry', 'is_delete', 'is_empty', 'is_label', 'startCluster',
+		'sizeOfArchive', 'timeDataCreated', 'dateDateCreated', 'datelastAccessed', 'timeUpdate', 'Update')
+
+	def __init__(self, data, offset = 0):
 		self.name = '' 
-		self.parseEntry()
+		self.parseEntry(data, offset)
 	
-	def parseEntry(self):
-		self.is_subEntry = self.data[0xB:0xC] == b'\x0f' 
-		self.is_delete = self.data[0] == 0xe5
-		self.is_empty = self.data[0] == 0x00 
-		self.is_label = Attribute.VOLLABEL in Attribute(int.from_bytes(self.data[0xB:0xC], byteorder='little'))
+	def parseEntry(self, data, offset):
+		(name, extension, self.attr, _, tenth, timeCreated, self.dateDateCreated, self.datelastAccessed,
+			clusterHigh, self.timeUpdate, self.Update, clusterLow, self.sizeOfArchive) = DIRECTORY_ENTRY.unpack_from(data, offset)
+
+		self.is_subEntry = self.attr == 0x0F 
+		self.is_delete = name[0] == 0xe5
+		self.is_empty = name[0] == 0x00 
+		self.is_label = Attribute.VOLLABEL.value & self.attr != 0
 
 		if not self.is_subEntry:
-			self.name = self.data[0x00:0x8]
-			self.extension = self.data[0x8:0xB] 
+			self.name = name
+			self.extension = extension
 			
 			if self.is_delete or self.is_empty:
 				self.name = "" 
 				return 
 			
-			self.attribute = Attribute(int.from_bytes(self.data[0xB:0xC], byteorder='little'))
-			if Attribute.VOLLABEL in self.attribute:
-				self.is_label = True 
+			if self.is_label:
 				return 
 			
-			self.dataTime() 
+			# Raw timestamps are kept, they are only turned into dates when asked for
+			self.timeDataCreated = tenth | timeCreated << 8
 
 			# cluster start and size of archive 
-			self.startClusterBytes = self.data[0x14:0x16][::-1] + self.data[0x1A:0x1C][::-1] 
-
-			self.startCluster = int.from_bytes(self.startClusterBytes, byteorder='big')
-
-			self.sizeOfArchive = int.from_bytes(self.data[0x1C:0x20], byteorder='little')
+			self.startCluster = clusterHigh << 16 | clusterLow
 		
 		else:
-			name = b""
-			for i in range(0x1, 0xB):
-				name += int.to_bytes(self.data[i], 1, byteorder='little')
-				if name.endswith(b"\xff\xff"):
-					name = name[:-2]
-					break
-			
-			for i in range(0xE, 0x1A):
-				name += int.to_bytes(self.data[i], 1, byteorder='little')
-				if name.endswith(b"\xff\xff"):
-					name = name[:-2]
-					break
-			
-			for i in range(0x1C, 0x20):
-				name += int.to_bytes(self.data[i], 1, byteorder='little')
-				if name.endswith(b"\xff\xff"):
-					name = name[:-2]
-					break
-			
-			self.name = name.decode('utf-16le').strip('\x00')
+			# 13 UTF-16 characters spread over three fragments, ended by 0x0000 and padded with 0xFFFF
+			name = bytes(data[offset + 0x1:offset + 0xB]) + bytes(data[offset + 0xE:offset + 0x1A]) + bytes(data[offset + 0x1C:offset + 0x20])
+			self.name = name.decode('utf-16le', errors='replace').split('\x00', 1)[0].rstrip('\uffff')
+
+	@property
+	def attribute(self):
+		return Attribute(self.attr)
 		
 	def is_directory(self):
-		return Attribute.DIRECTORY in self.attribute
+		return self.attr & Attribute.DIRECTORY.value != 0
 	
 	def is_archive(self):
-		return Attribute.ARCHIVE in self.attribute
+		return self.attr & Attribute.ARCHIVE.value != 0
 	
 	def is_active_entry(self):
-		return not (self.is_empty or self.is_subEntry or self.is_delete or self.is_label or Attribute.SYSTEM in self.attribute) 
-			
-	
-	def dataTime(self):
-		self.timeDataCreated = int.from_bytes(self.data[0xD:0x10], byteorder='little')
-		self.dateDateCreated = int.from_bytes(self.data[0x10:0x12], byteorder='little')
-		self.datelastAccessed = int.from_bytes(self.data[0x12:0x14], byteorder='little')
-		self.timeUpdate = int.from_bytes(self.data[0x16:0x18], byteorder='little')
-		self.Update = int.from_bytes(self.data[0x18:0x1A], byteorder='little')
-
-		h = (self.timeDataCreated & 0b111110000000000000000000) >> 19
-		m = (self.timeDataCreated & 0b000001111110000000000000) >> 13
-		s = (self.timeDataCreated & 0b000000000001111110000000) >> 7
-		ms =(self.timeDataCreated & 0b000000000000000001111111)
-		year = 1980 + ((self.dateDateCreated & 0b1111111000000000) >> 9)
-		mon = (self.dateDateCreated & 0b0000000111100000) >> 5
-		day = self.dateDateCreated & 0b0000000000011111
-
-		dateCreated_dt = datetime(year, mon, day, h, m, s)
-		self.dateCreated = dateCreated_dt.strftime("%A, %B %d, %Y, %I:%M:%S %p")
-
-		year = 1980 + ((self.datelastAccessed & 0b1111111000000000) >> 9)
-		mon = (self.datelastAccessed & 0b0000000111100000) >> 5
-		day = self.datelastAccessed & 0b0000000000011111
-
-		self.lastAccessed = datetime(year, mon, day)
-
-		h = (self.timeUpdate & 0b1111100000000000) >> 11
-		m = (self.timeUpdate & 0b0000011111100000) >> 5
-		s = (self.timeUpdate & 0b0000000000011111) * 2
-		year = 1980 + ((self.Update & 0b1111111000000000) >> 9)
-		mon = (self.Update & 0b0000000111100000) >> 5
-		day = self.Update & 0b0000000000011111
-
-		dateUpdate_dt = datetime(year, mon, day, h, m, s)
-		self.dateUpdate = dateUpdate_dt.strftime("%A, %B %d, %Y, %I:%M:%S %p")
+		return not (self.is_empty or self.is_subEntry or self.is_delete or self.is_label or self.attr & Attribute.SYSTEM.value) 
+
+	@property
+	def dateCreated(self):
+		return decodeDate(self.dateDateCreated, self.timeDataCreated >> 8, (self.timeDataCreated >> 7) & 0b111111)
+
+	@property
+	def lastAccessed(self):
+		return decodeDate(self.datelastAccessed)
+
+	@property
+	def dateUpdate(self):
+		return decodeDate(self.Update, self.timeUpdate, (self.timeUpdate & 0b11111) * 2)
 
 class RDET:
 	def __init__(self, data):
-		self.data = data
+		# data is either the directory's bytes or an iterable of its clusters, read as parsing goes
+		if isinstance(data, (bytes, bytearray, memoryview)):
+			data = [data]
 		self.entries: list[ENTRY] = [] 
-		self.entries = self.getEntryName() 
+		self.entries = self.getEntryName(data) 
+		# Case-folded name -> entry, so lookups do not scan the directory
+		self.index = {}
+		for entry in self.entries:
+			if entry.is_active_entry():
+				self.index.setdefault(entry.name.casefold(), entry)
 	
-	def getEntryName(self):
+	def getEntryName(self, chunks):
+		return list(self.iterEntries(chunks))
+
+	def iterEntries(self, chunks):
+		"""Yield the live entries, stopping at the end-of-directory marker without touching later clusters"""
 		name = ''
-		entries: list[ENTRY] = [] 
-		for i in range(0, len(self.data), 32):
-			entries.append(ENTRY(self.data[i: i + 32])) 
-			if entries[-1].is_empty or entries[-1].is_delete:
-				name = "" 
-				continue
-			elif entries[-1].is_subEntry:
-				name = entries[-1].name + name 
-				continue
+		for chunk in chunks:
+			for i in range(0, len(chunk) - 31, 32):
+				if chunk[i] == 0x00:
+					return
+				if chunk[i] == 0xe5:
+					name = "" 
+					continue
+				entry = ENTRY(chunk, i)
+				if entry.is_subEntry:
+					name = entry.name + name 
+					continue
 
-			if name != '':
-				entries[-1].name = name
-			else:
-				extension = entries[-1].extension.strip().decode() 
-				if extension != '':
-					entries[-1].name = entries[-1].name.strip().decode() + '.' + extension
+				if name != '':
+					entry.name = name
 				else:
-					entries[-1].name = entries[-1].name.strip().decode()
-			name = ''
-		return entries 
+					extension = entry.extension.strip().decode() 
+					if extension != '':
+						entry.name = entry.name.strip().decode() + '.' + extension
+					else:
+						entry.name = entry.name.strip().decode()
+				name = ''
+				yield entry
 	
 	def getActiveEntries(self):
 		entries = [] 
@@ -184,20 +273,22 @@ class RDET:
 		return entries
 	
 	def findEntry(self, name):
-		for i in range(len(self.entries)):
-			if self.entries[i].name.lower() == name.lower() and self.entries[i].is_active_entry():
-				return self.entries[i]
-		
-		return None 
+		return self.index.get(name.casefold())
 
 class FAT32: 
-	def __init__(self, sector_starting, usb) -> None:
+	# Upper bound for a single read of a contiguous cluster run
+	MAX_IO_SIZE = 4 * 1024 * 1024
+	# The FAT is compared with the previous refresh in blocks of this many bytes
+	FAT_BLOCK_SIZE = 4096
+
+	def __init__(self, sector_starting, device, maxIOSize = MAX_IO_SIZE, namespace = None) -> None:
 		self.sectorStarting = sector_starting
+		self.maxIOSize = maxIOSize
+		# Entry ids start with this, volumes read side by side are each given a namespace of their own
+		self.idPrefix = "FAT32_" if namespace is None else "FAT32_" + str(namespace) + "_"
 		self.cwd =[]
-		self.usb = usb
-		self.fin = open(self.usb.DeviceID, "rb") 
-		self.fin.seek(sector_starting * 512) 
-		self.data = self.fin.read(512) 
+		self.device = open_device(device)
+		self.data = self.device.read(sector_starting * 512, 512) 
 		self.bootSector = {} 
 		self.getDataBootSector() 
 		self.bootSector['FAT Name'] = self.bootSector['FAT Name'].decode()
@@ -210,21 +301,34 @@ class FAT32:
 		self.startClusterRDET = self.bootSector['Starting Cluster of RDET'] 
 		self.startSectorData = self.bootSector['Starting Sector of Data'] 
 
-		# Read FAT
-		self.fin.seek((self.sectorStarting + self.reservedSectors) * self.bytePerSector)
+		# Called with (entries, bytes) for every directory parsed, it may raise to stop reading
+		self.progress = None
+		# Digests of the FAT blocks the chains of read directories run through, taken as each directory is read
+		self.fatBlocks = {}
+		self.readTables()
 
+	def readTables(self):
+		# Read FAT lazily, nothing is read until a cluster of that copy is looked up
+		fatStart = (self.sectorStarting + self.reservedSectors) * self.bytePerSector
 		fatSize = self.bytePerSector * self.sectorPerFat
 		# Number of fat 
 		self.FATList: list[FAT] = [] 
-		for _ in range(self.numberOfFat):
-			self.FATList.append(FAT(self.fin.read(fatSize)))
+		for i in range(self.numberOfFat):
+			self.FATList.append(FAT(self.device, fatStart + i * fatSize, fatSize))
+
+		# With mirroring disabled only the FAT named in the extended flags is up to date
+		extFlags = self.bootSector['Extended Flags']
+		activeFat = extFlags & 0x0F if extFlags & 0x80 else 0
+		self.FAT = self.FATList[activeFat]
 
-		# read RDET 
-		clusterIndex = self.bootSector['Starting Cluster of RDET']
-		self.RDET = RDET(self.getClusterS(clusterIndex)) 
-		self.DET = {} 
 		# DET stores information about subfolders, unlike RDET which only manages entries in the root directory.
-		self.DET[clusterIndex] = self.RDET
+		self.DET = {} 
+		# Start cluster -> (extents, digest, bytes hashed) of every directory read, to tell on refresh whether it changed
+		self.directories = {}
+		# Normalized directory path below the volume -> its RDET
+		self.pathCache = {}
+		# read RDET 
+		self.RDET = self.getDET(self.startClusterRDET)
 
 		# Get volume label 
 		for item in self.RDET.entries:
@@ -239,7 +343,9 @@ class FAT32:
 		self.bootSector['Number of FATs'] = int.from_bytes(self.data[0x10:0x11], 'little')
 		self.bootSector['Sectors In Volume'] = int.from_bytes(self.data[0x20:0x24], 'little')
 		self.bootSector['Sectors Per FAT'] = int.from_bytes(self.data[0x24:0x28], 'little')
+		self.bootSector['Extended Flags'] = int.from_bytes(self.data[0x28:0x2A], 'little')
 		self.bootSector['Starting Cluster of RDET'] = int.from_bytes(self.data[0x2C:0x30], 'little')
+		self.bootSector['Volume Serial'] = int.from_bytes(self.data[0x43:0x47], 'little')
 		self.bootSector['FAT Name'] = self.data[0x52:0x59] 
 		self.bootSector['Starting Sector of Data'] = self.bootSector['Reserved Sectors'] + self.bootSector['Number of FATs'] * self.bootSector['Sectors Per FAT']
 
@@ -248,14 +354,42 @@ class FAT32:
 	
 
 	def getClusterS(self, index): 
-		clusterList = self.FATList[0].getClustersChain(index)
-		data = b"" 
-
-		for i in clusterList:
-			sectorIndex = self.clusterToSectorIndex(i)
-			self.fin.seek((sectorIndex + self.sectorStarting) * self.bytePerSector) 
-			data += self.fin.read(self.bytePerSector * self.sectorPerCluster)
-		return data  
+		return self.readExtents(self.FAT.getExtents(index))
+
+	def iterChain(self, index):
+		# Reads start at one cluster and double up to maxIOSize, so a mostly empty directory costs one read
+		clusterSize = self.bytePerSector * self.sectorPerCluster
+		maxClusters = max(1, self.maxIOSize // clusterSize)
+		count = 1
+		for start, length in self.FAT.getExtents(index):
+			while length > 0:
+				run = min(length, count)
+				yield self.readExtents(((start, run),))
+				start += run
+				length -= run
+				count = min(count * 2, maxClusters)
+
+	def readExtents(self, extents, size = None):
+		# Each run of contiguous clusters is read straight into one preallocated buffer
+		clusterSize = self.bytePerSector * self.sectorPerCluster
+		total = sum(length for _, length in extents) * clusterSize
+		if size is not None:
+			total = min(total, size)
+		data = bytearray(total)
+
+		with memoryview(data) as view:
+			pos = 0
+			for start, length in extents:
+				if pos >= total: break
+				offset = (self.clusterToSectorIndex(start) + self.sectorStarting) * self.bytePerSector
+				runEnd = min(pos + length * clusterSize, total)
+				while pos < runEnd:
+					count = self.device.readinto(offset, view[pos:min(runEnd, pos + self.maxIOSize)])
+					if not count:
+						raise ValueError(f"Cluster {start} over end of device")
+					pos += count
+					offset += count
+		return data
 	
 	def isFAT32(self):
 		fat_name = self.bootSector.get("FAT Name", "").strip().upper()
@@ -277,24 +411,47 @@ class FAT32:
 			path.pop(0) 
 		CDET = self.RDET
 		
+		# Every resolved prefix is remembered, so a walk only looks up components not seen before
+		key = ""
 		for dir in path:
+			key += "\\" + dir.casefold()
+			if key in self.pathCache:
+				CDET = self.pathCache[key]
+				continue
 			entry = CDET.findEntry(dir) 
 			if entry is None:
 				raise Exception("Directory not found")
 			if entry.is_directory():
-				if entry.startCluster == 0:
-					CDET = self.DET[self.bootSector["Starting Cluster of RDET"]] 
-					continue
-				if entry.startCluster in self.DET:
-					CDET = self.DET[entry.startCluster]
-					continue
-
-				self.DET[entry.startCluster] = RDET(self.getClusterS(entry.startCluster))
-				CDET = self.DET[entry.startCluster]
+				CDET = self.getDET(entry.startCluster)
+				self.pathCache[key] = CDET
 			else:
 				raise Exception("Not a directory")
 
 		return CDET 
+
+	def getDET(self, cluster):
+		# ".." of a first level folder points at cluster 0, meaning the root directory
+		if cluster == 0:
+			cluster = self.startClusterRDET
+		if cluster not in self.DET:
+			digest = hashlib.blake2b(digest_size=16)
+			sizes = []
+			self.DET[cluster] = RDET(self.iterDigest(self.iterChain(cluster), digest, sizes))
+			# Only the clusters parsed up to the end-of-directory marker are hashed
+			extents = self.FAT.getExtents(cluster)
+			self.directories[cluster] = (extents, digest.digest(), sum(sizes))
+			for block in self.getFatBlocks(extents):
+				if block not in self.fatBlocks:
+					self.fatBlocks[block] = self.readFatBlock(block)
+			if self.progress is not None:
+				self.progress(len(self.DET[cluster].entries), sum(length for _, length in extents) * self.bytePerSector * self.sectorPerCluster)
+		return self.DET[cluster]
+
+	def iterDigest(self, chunks, digest, sizes):
+		for chunk in chunks:
+			digest.update(chunk)
+			sizes.append(len(chunk))
+			yield chunk
 	
 	def getCWD(self):
 		if len(self.cwd) == 1:
@@ -310,30 +467,71 @@ class FAT32:
 			else:
 				entryList = self.RDET.getActiveEntries() 
 			for entry in entryList:
-				obj = {}
-				obj["ID"] = ""
-				obj["Flags"] = entry.attribute.value
-				obj["Date Created"] = entry.dateCreated
-				obj["Date Modified"] = entry.dateUpdate
-				obj["Size"] = entry.sizeOfArchive 
-				obj["Name"] = entry.name 
-				obj["Path"] = ""
-				obj["Parent"] = self.volume
-				obj["content"] = ""
-				obj["Attribute"] =  [attr.name for attr in Attribute if attr in entry.attribute]
-				obj["Total Size"] = self.bootSector["Sectors In Volume"] * self.bytePerSector
-
-				if entry.startCluster == 0:
-					obj["sector"] = (entry.startCluster + 2) * self.sectorPerCluster
-				else:
-					obj["sector"] = (entry.startCluster) * self.sectorPerCluster
-				ret.append(obj)
+				ret.append(self.entryObject(entry))
 			return ret
 		except Exception as error:
 			raise(error)
 
+	def entryObject(self, entry):
+		obj = {}
+		obj["ID"] = ""
+		obj["Flags"] = entry.attribute.value
+		obj["Date Created"] = entry.dateCreated
+		obj["Date Modified"] = entry.dateUpdate
+		obj["Size"] = entry.sizeOfArchive 
+		obj["Name"] = entry.name 
+		obj["Path"] = ""
+		obj["Parent"] = self.volume
+		obj["content"] = ""
+		obj["Attribute"] =  [attr.name for attr in Attribute if attr in entry.attribute]
+		obj["Total Size"] = self.bootSector["Sectors In Volume"] * self.bytePerSector
+		obj["Cluster"] = entry.startCluster
+
+		if entry.startCluster == 0:
+			obj["sector"] = (entry.startCluster + 2) * self.sectorPerCluster
+		else:
+			obj["sector"] = (entry.startCluster) * self.sectorPerCluster
+		return obj
+
+	def listDirectory(self, cluster, parentId):
+		"""One level of the tree: the entries of the directory starting at cluster"""
+		ret = []
+		for entry in self.getDET(cluster).getActiveEntries():
+			if entry.name in [".", ".."]:
+				continue
+			obj = self.entryObject(entry)
+			# Ids only have to be unique below the parent, so they are handed out without a global counter
+			obj["ID"] = parentId + "_" + str(len(ret))
+			obj["Parent"] = parentId
+			if obj["Flags"] == 16:
+				# Unknown until the folder itself is opened
+				obj["Size"] = None
+			elif obj["Flags"] == 32:
+				obj["content"] = self.readText(entry)
+			ret.append(obj)
+		return ret
+
 	
 	def getText(self, path):
+		return str(self.getContent(path))
+
+	def getContent(self, path):
+		return self.readText(self.findFile(path))
+
+	def openFile(self, path):
+		# Read-only file object over any file, read straight from its cluster chain
+		entry = self.findFile(path)
+		return self.openChain(entry.startCluster, entry.sizeOfArchive)
+
+	def openChain(self, cluster, size):
+		clusterSize = self.bytePerSector * self.sectorPerCluster
+		extents = []
+		if size > 0 and cluster >= 2:
+			for start, length in self.FAT.getExtents(cluster):
+				extents.append(((self.clusterToSectorIndex(start) + self.sectorStarting) * self.bytePerSector, length * clusterSize))
+		return ExtentFile(self.device, extents, size)
+
+	def findFile(self, path):
 		parts = self.parsePath(path) 
 
 		if len(parts) > 1:
@@ -348,33 +546,133 @@ class FAT32:
 			raise Exception("File do not exist")
 		if entry.is_directory():
 			raise Exception("Is Directory")
-		
-		if entry.extension.decode() != "TXT": return ""
+		return entry
 
-		str = ""
-		size = entry.sizeOfArchive
-		ind = 0
-		if size > 0: 
-			ind = self.FATList[0].getClustersChain(entry.startCluster)
-			for i in ind:
-				if size <= 0: break
-				offset = self.clusterToSectorIndex(i) 
-				self.fin.seek((offset + self.sectorStarting) * self.bytePerSector)
-				rawData = self.fin.read(min(self.sectorPerCluster * self.bytePerSector, size))
-				size -= self.sectorPerCluster * self.bytePerSector
+	def readText(self, entry):
+		# Handle to the file's text, nothing is read until it is displayed
+		if entry.extension.decode() != "TXT": return ""
 
+		if entry.sizeOfArchive <= 0: return ""
+		return FileContent(partial(self.readChain, entry.startCluster), entry.sizeOfArchive)
+
+	def readChain(self, cluster, size = None):
+		return self.readExtents(self.FAT.getExtents(cluster), size)
+
+	"""SNAPSHOT"""
+
+	def getIdentity(self):
+		return "FAT32-%08X-%d-%d" % (self.bootSector['Volume Serial'], self.sectorStarting, self.sectorInVolume)
+
+	def getFingerprint(self):
+		# Creating, growing or deleting a file rewrites the FAT, renaming one in the root rewrites the RDET
+		digest = hashlib.blake2b(digest_size=16)
+		for start in range(0, self.FAT.size, self.maxIOSize):
+			digest.update(self.device.view(self.FAT.offset + start, min(self.maxIOSize, self.FAT.size - start)))
+		digest.update(self.readChain(self.startClusterRDET))
+		return digest.hexdigest()
+
+	def toSnapshot(self, items, unread = ()):
+		# Parents are saved as row positions, ids are handed out again when the rows are read back
+		# unread holds the ids of folders whose children are not in items
+		positions = {item["ID"]: position for position, item in enumerate(items)}
+		rows = []
+		for position, item in enumerate(items):
+			content = item["content"]
+			rows.append((
+				position,
+				positions.get(item["Parent"]),
+				item["Name"],
+				item["Flags"],
+				item["Size"],
+				item["Date Created"].isoformat() if item["Date Created"] else None,
+				item["Date Modified"].isoformat() if item["Date Modified"] else None,
+				"\n".join(item["Attribute"]) if item["Attribute"] is not None else None,
+				item["Cluster"],
+				content.size if isinstance(content, FileContent) else None,
+				int(item["ID"] not in unread),
+			))
+		return rows
+
+	def fromSnapshot(self, num, rows):
+		rootId = self.idPrefix + str(num)
+		getId = lambda position: rootId if position == 0 else rootId + "_" + str(position)
+		entries = []
+		for position, parent, name, flags, size, created, modified, attributes, cluster, textSize, listed in rows:
+			entries.append({
+				"ID": getId(position),
+				"Flags": flags,
+				"Date Created": datetime.fromisoformat(created) if created else None,
+				"Date Modified": datetime.fromisoformat(modified) if modified else None,
+				"Size": size,
+				"Name": name,
+				"Path": "",
+				"Parent": None if parent is None else getId(parent),
+				"content": FileContent(partial(self.readChain, cluster), textSize) if textSize is not None else "",
+				"Attribute": attributes.split("\n") if attributes else ([] if attributes is not None else None),
+				"Total Size": self.bootSector["Sectors In Volume"] * self.bytePerSector,
+				"Cluster": cluster,
+				"Listed": bool(listed),
+			})
+		return num + 1, entries
+
+	"""REFRESH"""
+
+	def getFatBlocks(self, extents):
+		perBlock = self.FAT_BLOCK_SIZE // 4
+		return {block for start, length in extents for block in range(start // perBlock, (start + length - 1) // perBlock + 1)}
+
+	def readFatBlock(self, block):
+		start = block * self.FAT_BLOCK_SIZE
+		return hashlib.blake2b(self.device.view(self.FAT.offset + start, min(self.FAT_BLOCK_SIZE, self.FAT.size - start)), digest_size=8).digest()
+
+	def refresh(self, clusters):
+		"""Read the volume again, returns which of the directories starting at clusters changed since they were read"""
+		if self.device.read(self.sectorStarting * 512, 512) != self.data:
+			raise ValueError("Boot sector changed, the volume was replaced")
+		fatBlocks, self.fatBlocks = self.fatBlocks, {}
+		directories = self.directories
+		self.readTables()
+
+		changed = []
+		for cluster in clusters:
+			old = directories.get(cluster)
+			# Directories listed before any digest was taken can only be compared by reading them again
+			if old is None:
+				changed.append(cluster)
+				continue
+			extents, digest, size = old
+			# Clusters whose FAT entries sit in a block that changed had their chains relinked,
+			# only those chains have to be walked and parsed again
+			blocks = {block: self.fatBlocks.get(block) or self.readFatBlock(block) for block in self.getFatBlocks(extents)}
+			if any(fatBlocks.get(block) != blockDigest for block, blockDigest in blocks.items()):
 				try:
-					str += rawData.decode()
-				except Exception as e:
-					raise e
-		return str 
+					if self.FAT.getExtents(cluster) != extents:
+						changed.append(cluster)
+						continue
+					self.getDET(cluster)
+				except (ValueError, IndexError):
+					changed.append(cluster)
+					continue
+				if self.directories[cluster][1] != digest:
+					changed.append(cluster)
+				continue
+			# A rename or an empty file touches no FAT entry, the bytes hashed before are read back along the old chain
+			if hashlib.blake2b(self.readExtents(extents, size), digest_size=16).digest() != digest:
+				changed.append(cluster)
+			else:
+				self.directories.setdefault(cluster, old)
+				for block, blockDigest in blocks.items():
+					self.fatBlocks.setdefault(block, blockDigest)
+		return changed
 
-	def applyGUI(self, num):
+	def applyGUI(self, num, lazy = False, batch = None):
+		# batch is called with the entries handed their ids since the last directory was read, the root first
 		entries = []
 		stored = []
+		sent = 0
 
 		obj = {
-			"ID": "FAT32_" + str(num),
+			"ID": self.idPrefix + str(num),
 			"Flags": 16, 
 			"Date Created": None,
 			"Date Modified": None, 
@@ -385,16 +683,22 @@ class FAT32:
 			"content": "",
 			"Attribute": None,
 			"Total Size": self.bootSector["Sectors In Volume"] * self.bytePerSector,
+			"Cluster": self.startClusterRDET,
 		}
 		num += 1
 
+		# Lazy mode only hands back the volume root, folders are listed through listDirectory when opened
+		if lazy:
+			obj["Size"] = None
+			return num, [obj]
+
 		entries.append(obj)
 		stored.append(obj) 
 
 		# define id, name, parent for each entry 
 		while len(stored) != 0:
 			entry = stored.pop(0)
-			entry["ID"] = "FAT32_" + str(num)
+			entry["ID"] = self.idPrefix + str(num)
 			num += 1
 			
 			if entry["Path"] == "":
@@ -410,25 +714,23 @@ class FAT32:
 						entries.append(item)
 						stored.append(item) 
 						item["Path"] = entry["Path"]
+				# Entries are taken off stored in the order they were added to entries
+				done = len(entries) - len(stored)
+				if batch is not None and done > sent:
+					batch(entries[sent:done])
+					sent = done
 			elif entry["Flags"] == 32:
-				entry["content"] = self.getText(entry["Path"])
+				entry["content"] = self.getContent(entry["Path"])
+		if batch is not None and len(entries) > sent:
+			batch(entries[sent:])
 		
 
 		# Get total size 
-		def defineSize(entry, entries):
-			childrent = [e for e in entries if entry["ID"] == e["Parent"]]
-			total_size = 0
-			for child in childrent:
-				if child["Flags"] == 32:
-					total_size += child["Size"] 
-				else: 
-					total_size += defineSize(child, entries)
-			
-			entry["Size"] = total_size
-			return total_size
-		
+		sizes = Tree()
+		for entry in entries:
+			sizes.add(entry["ID"], entry["Parent"], entry["Size"] if entry["Flags"] == 32 else None, entry["Flags"] != 32)
+		sizes.aggregate()
 		for entry in entries:
-			if entry["Parent"] is None:
-				defineSize(entry, entries)
+			entry["Size"] = sizes.get_size(entry["ID"])
 	
 		return num, entries
@@ -1,32 +1,82 @@
 from datetime import datetime
+import struct
+import io
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from .device import open_device
+from .stream import FileContent, ExtentFile
+from .tree import Tree
 SECTOR_SIZE = 512
 WIN_EPOCH = 116444736000000000
+# The MFT is read this many bytes at a time and its records parsed in place
+MFT_CHUNK_SIZE = 8 * 1024 * 1024
+# Smaller MFTs are parsed in this process, starting workers would cost more than it saves
+PARALLEL_MIN_RECORDS = 64 * 1024
 
-def get_total_size(entry, list_file, volume_name):
-    total_size = 0
-    if entry.is_folder():
-        for child in list_file:
-            if entry.get_id() == child.get_parent_id():
-                total_size += get_total_size(child, list_file, volume_name)
-    else:
-        total_size += entry.get_size()
-    return total_size
-
-def get_parent_name(parent_id, list_file, volume_name):
-    for entry in list_file:
-        if parent_id == 5:
-            return volume_name
-        if parent_id == entry.get_id():
-            return entry.get_file_name()
-    return None
-        
-def get_infomation(entry, list_file, volume_name, counter, total_sectors):
+# Signature, offset of the first attribute, state, bytes in use, bytes allocated, record number
+RECORD_HEADER = struct.Struct("<4s16xHHII12xI")
+# Type, length and non-resident flag shared by every attribute
+ATTRIBUTE_HEADER = struct.Struct("<IIB")
+# Content size and offset of a resident attribute
+RESIDENT_HEADER = struct.Struct("<IH")
+# Runlist offset, then the real size of a non-resident attribute
+NON_RESIDENT_HEADER = struct.Struct("<H14xQ")
+STANDARD_INFORMATION = struct.Struct("<QQQQ")
+# Parent reference, flags and name length of $FILE_NAME
+FILE_NAME = struct.Struct("<Q48xI4xB")
+# Update sequence array offset and count at the start of FILE and INDX records
+FIXUP_HEADER = struct.Struct("<4xHH")
+# Index block size and clusters per block of $INDEX_ROOT
+INDEX_ROOT = struct.Struct("<8xIB")
+# Entries offset and total size of an index node header
+INDEX_NODE = struct.Struct("<II")
+# File reference, entry length, key length and flags of an index entry
+INDEX_ENTRY = struct.Struct("<QHHI")
+# Creation time, modification time and real size in a $FILE_NAME index key
+INDEX_KEY = struct.Struct("<8xQQ24xQ")
+# LSN and sequence number in the header of a FILE record
+RECORD_STATE = struct.Struct("<8xQH")
+# System page size and restart area offset of a $LogFile restart page
+RESTART_PAGE = struct.Struct("<16xI4xH")
+# Maximum size, allocation delta, journal id and lowest valid USN in $UsnJrnl:$Max
+USN_JOURNAL = struct.Struct("<QQQQ")
+# Length and major version at the start of every $UsnJrnl:$J record
+USN_RECORD_HEADER = struct.Struct("<IH")
+# File and parent references of a version 2 record, version 3 widens them to 128 bits
+USN_RECORD_V2 = struct.Struct("<8xQQ")
+USN_RECORD_V3 = struct.Struct("<8xQ8xQ")
+# Records never span a page of the journal, the rest of a page is left zeroed
+USN_PAGE_SIZE = 4096
+JOURNAL_CHUNK_SIZE = 1024 * 1024
+INDEX_ENTRY_SUBNODE = 0x01
+INDEX_ENTRY_LAST = 0x02
+# Attributes read from each record, the others are stepped over
+ATTRIBUTE_TYPES = {
+    0x10: "StandardInformation",
+    0x30: "FileName",
+    0x60: "VolumeName",
+    0x80: "Data",
+}
+
+def apply_fixups(record, sector_size=SECTOR_SIZE):
+    # The last two bytes of every sector were swapped out for the update sequence number
+    usa_offset, usa_count = FIXUP_HEADER.unpack_from(record)
+    for sector in range(1, usa_count):
+        end = sector * sector_size
+        if end > len(record):
+            break
+        record[end - 2 : end] = record[usa_offset + 2 * sector : usa_offset + 2 * sector + 2]
+    return record
+
+def get_infomation(entry, size, counter, total_sectors):
     return {
         "ID": str(counter)+"NTFS"+str(entry.get_id()),
+        "Record": entry.get_id(),
         "Name": entry.get_file_name(),
         "Is Folder": entry.is_folder(),
         "Parent ID": str(counter)+"NTFS"+str(entry.get_parent_id()),
-        "Size": get_total_size(entry, list_file, volume_name),
+        "Size": size,
         "Create Time": entry.get_create_time(),
         "Modify Time": entry.get_modify_time(),
         "Data": entry.get_data(),
@@ -35,7 +85,7 @@ def get_infomation(entry, list_file, volume_name, counter, total_sectors):
     }
 
 class Partition:
-    def __init__(self, description_in_mbr, location_of_disk, relative_starting_sector):
+    def __init__(self, description_in_mbr, device, relative_starting_sector):
         self.status = (
             "bootable"
             if description_in_mbr[0] == 0x80
@@ -51,7 +101,7 @@ class Partition:
         )
         self.number_of_sectors = int.from_bytes(description_in_mbr[12:16], "little")
         self.starting_sector = relative_starting_sector+int.from_bytes(description_in_mbr[8:12], "little")
-        self.location_of_disk = location_of_disk
+        self.device = open_device(device)
 
 class EBR:
     def __init__(self,general_information: Partition):
@@ -63,13 +113,10 @@ class EBR:
     def read_extended_partition(self):
         curLBA = 0
         while True:
-            filein = open(self.partition.location_of_disk, "rb")
-            filein.seek((self.base_extended + curLBA) * SECTOR_SIZE)
-            partition_bytes = filein.read(512)
+            partition_bytes = self.partition.device.read((self.base_extended + curLBA) * SECTOR_SIZE, 512)
             partition_extend = partition_bytes[446:462]
             next_ebr = partition_bytes[462:478]
-            filein.close()
-            p = Partition(partition_extend, self.partition.location_of_disk, self.base_extended + curLBA)
+            p = Partition(partition_extend, self.partition.device, self.base_extended + curLBA)
             self.list_of_partition.append(p)
             if next_ebr == b'\x00' * 16:
                 break
@@ -78,91 +125,557 @@ class EBR:
     def get_list_of_partition(self):
         return self.list_of_partition
 
+def list_partitions(device):
+    """NTFS and FAT32 partitions of a disk, primary ones first and logical ones where their EBR is."""
+    partitions = []
+    mbr = device.read(446, 64)
+    for i in range(4):
+        par = mbr[i * 16:(i + 1) * 16]
+        partition = Partition(par, device, 0)
+        if partition.type in ("NTFS", "FAT32"):
+            partitions.append(partition)
+        elif partition.type == "EBR":
+            ext = EBR(partition)
+            for p in ext.get_list_of_partition():
+                if p.type in ("NTFS", "FAT32"):
+                    partitions.append(p)
+    return partitions
+
+def iter_mft_records(device, extents, record_size):
+    # Each extent holds whole records, they are sliced out of one read without copying
+    for offset, length in extents:
+        chunk = device.view(offset, length)
+        for record in range(0, length - record_size + 1, record_size):
+            yield chunk[record : record + record_size]
+
+def parse_mft_records(device, extents, record_size, bytes_per_cluster, start_partition, progress=None):
+    # progress(records, bytes) is called after each extent
+    entries = []
+    volume_name = None
+    for extent in extents:
+        for entry_bytes in iter_mft_records(device, [extent], record_size):
+            if entry_bytes[0] == 0:
+                continue
+            entry = NTFS_Master_File_Table_Entry(
+                entry_bytes,
+                bytes_per_cluster,
+                device,
+                start_partition,
+            )
+            if entry.get_file_name() == "$Volume":
+                volume_name = entry.attributes["VolumeName"].volume_name
+
+            if not entry.is_deleted() and entry.get_file_name() != None:
+                entries.append(entry)
+        if progress is not None:
+            progress(extent[1] // record_size, extent[1])
+    return entries, volume_name
+
+def parse_mft_shard(path, extents, record_size, bytes_per_cluster, start_partition):
+    """Worker side of the parallel MFT scan, returns compact records instead of full entries."""
+    device = open_device(path, cache_mb=0)
+    try:
+        entries, volume_name = parse_mft_records(device, extents, record_size, bytes_per_cluster, start_partition)
+        return [entry.get_record() for entry in entries], volume_name
+    finally:
+        device.close()
+
 class NTFS:
-    counter = 0
-    def __init__(self, general_information: Partition):
-        NTFS.counter += 1
+    # Numbers volumes opened without a namespace, next() on it is safe across threads
+    counter = itertools.count(1)
+    def __init__(self, general_information: Partition, workers=None, browse=False, namespace=None):
+        # Entry ids start with this number, volumes read side by side are each given their own
+        self.number = next(NTFS.counter) if namespace is None else namespace
+        # Called with (records, bytes) as the MFT is scanned, it may raise to stop the scan
+        self.progress = None
         self.partition = general_information
         self.start_partition = self.partition.starting_sector * SECTOR_SIZE
         self.volume_boot_record = NTFS_Volume_Boot_Record(
             self.start_partition,
-            self.partition.location_of_disk,
+            self.partition.device,
         )
         self.bytes_per_cluster = (
             self.volume_boot_record.number_of_bytes_per_sector
             * self.volume_boot_record.number_of_sectors_per_cluster
         )
+        self.record_size = self.volume_boot_record.number_of_bytes_per_entry_in_mft
+        # Processes used to parse large MFTs, None or 1 parses them here
+        self.workers = workers
         self.master_file_table = []
         self.list_file = []
-        self.read_master_file_table()
+        # Record id -> entry, and the parent -> children index with folder sizes
         self.nodes = {}
+        self.tree = Tree()
+        self.read_mft_layout()
+        # Where the change journal ended at the last refresh, without it the next one compares every folder
+        self.journal_position = None
+        # Browsing lists directories from their indexes, the MFT is only scanned in full otherwise
+        if browse:
+            self.volume_name = self.read_record(3).attributes["VolumeName"].volume_name
+        else:
+            self.read_master_file_table()
 
-    def read_master_file_table(self):
-        fin = open(self.partition.location_of_disk, "rb")
+    def read_mft_layout(self):
         start_bytes = (
-            self.partition.starting_sector * SECTOR_SIZE
-            + self.volume_boot_record.starting_cluster_of_mft
-            * self.volume_boot_record.number_of_bytes_per_sector
-            * self.volume_boot_record.number_of_sectors_per_cluster
+            self.start_partition
+            + self.volume_boot_record.starting_cluster_of_mft * self.bytes_per_cluster
         )
-        fin.seek(start_bytes)
-        number_of_entries = 1
-        while number_of_entries:
-            number_of_entries -= 1
-            entry_bytes = fin.read(
-                self.volume_boot_record.number_of_bytes_per_entry_in_mft
-            )
-            if entry_bytes[0] == 0:
-                continue
-            entry = NTFS_Master_File_Table_Entry(
-                entry_bytes,
-                self.bytes_per_cluster,
-                self.partition.location_of_disk,
-                self.start_partition,
-            )
-            if entry.get_file_name() == "$MFT":
-                number_of_entries = (
-                    entry.get_size()
-                    // self.volume_boot_record.number_of_bytes_per_entry_in_mft
-                    - 1
-                )
-            if entry.get_file_name() == "$Volume":
-                self.volume_name = entry.attributes["VolumeName"].volume_name
+        # Record 0 is $MFT itself, its $DATA gives the number of records and where they are stored
+        first_record = self.partition.device.read(start_bytes, self.record_size)
+        self.number_of_entries, self.mft_runlist = self.read_mft_data(first_record)
 
-            if not entry.is_deleted() and entry.get_file_name() != None:
-                self.list_file.append(
-                    (entry.get_id(), entry.get_parent_id(), entry.get_file_name())
+    def read_master_file_table(self, batch=None):
+        # batch is called with the items of each part of the MFT once it is parsed, folders without a size
+        if (
+            self.workers and self.workers > 1
+            and self.number_of_entries >= PARALLEL_MIN_RECORDS
+            and self.partition.device.path is not None
+        ):
+            self.read_master_file_table_parallel(batch)
+        else:
+            self.master_file_table = []
+            for extent in self.mft_extents(0, self.number_of_entries):
+                entries, volume_name = parse_mft_records(
+                    self.partition.device,
+                    [extent],
+                    self.record_size,
+                    self.bytes_per_cluster,
+                    self.start_partition,
+                    self.progress,
                 )
-                self.master_file_table.append(entry)
+                self.master_file_table.extend(entries)
+                if volume_name is not None:
+                    self.volume_name = volume_name
+                if batch is not None:
+                    batch(self.get_items(entries))
+
+        for entry in self.master_file_table:
+            self.list_file.append(
+                (entry.get_id(), entry.get_parent_id(), entry.get_file_name())
+            )
         self.list_file.append((5,None, self.volume_name))  # Add root node
-        fin.close()
-            
+        self.build_indexes()
+
+    def build_indexes(self):
+        # Folder sizes count every child record, hidden and system files included
+        for entry in self.master_file_table:
+            self.nodes[entry.get_id()] = entry
+            self.tree.add(entry.get_id(), entry.get_parent_id(), None if entry.is_folder() else entry.get_size(), entry.is_folder())
+        self.tree.aggregate()
+
+    def get_entry(self, record_id):
+        return self.nodes.get(record_id)
+
+    def get_children(self, record_id):
+        return [self.nodes[child] for child in self.tree.get_children(record_id)]
+
+    def get_parent_name(self, record_id):
+        entry = self.nodes.get(record_id)
+        if entry is None:
+            return None
+        parent_id = entry.get_parent_id()
+        if parent_id == 5:
+            return self.volume_name
+        parent = self.nodes.get(parent_id)
+        return parent.get_file_name() if parent is not None else None
+
+    def read_master_file_table_parallel(self, batch=None):
+        # A few shards per worker keeps them all busy when some parts of the MFT are denser than others
+        shards = self.workers * 4
+        per_shard = -(-self.number_of_entries // shards)
+        parse = partial(
+            parse_mft_shard,
+            self.partition.device.path,
+            record_size=self.record_size,
+            bytes_per_cluster=self.bytes_per_cluster,
+            start_partition=self.start_partition,
+        )
+        extents = [
+            self.mft_extents(first, min(per_shard, self.number_of_entries - first))
+            for first in range(0, self.number_of_entries, per_shard)
+        ]
+        with ProcessPoolExecutor(self.workers) as executor:
+            try:
+                # map keeps the shards in MFT order
+                for shard, (records, volume_name) in zip(extents, executor.map(parse, extents)):
+                    entries = [NTFS_MFT_Record(record, self) for record in records]
+                    self.master_file_table.extend(entries)
+                    if volume_name is not None:
+                        self.volume_name = volume_name
+                    if batch is not None:
+                        batch(self.get_items(entries))
+                    if self.progress is not None:
+                        size = sum(length for _, length in shard)
+                        self.progress(size // self.record_size, size)
+            except BaseException:
+                # Shards that have not started are dropped instead of waited for
+                executor.shutdown(cancel_futures=True)
+                raise
+
+    def read_mft_data(self, entry_bytes):
+        view = memoryview(entry_bytes)
+        offset = RECORD_HEADER.unpack_from(view)[1]
+        while offset + ATTRIBUTE_HEADER.size <= len(view):
+            attribute_type, attribute_length, non_resident = ATTRIBUTE_HEADER.unpack_from(view, offset)
+            if attribute_type == 0xFFFFFFFF or attribute_length == 0:
+                break
+            if attribute_type == 0x80 and non_resident:
+                offset_to_runlist, data_size = NON_RESIDENT_HEADER.unpack_from(view, offset + 32)
+                runlist_bytes = view[offset + offset_to_runlist : offset + attribute_length]
+                runlist = Cluster_runlist(runlist_bytes, self.bytes_per_cluster).get_runlist()
+                return data_size // self.record_size, runlist
+            offset += attribute_length
+        raise ValueError("$MFT has no non-resident $DATA attribute")
+
+    def mft_extents(self, first, count):
+        """Disk ranges holding count records from record first, cut into chunks of whole records."""
+        extents = []
+        skip = first * self.record_size
+        remaining = count * self.record_size
+        chunk_size = max(self.record_size, MFT_CHUNK_SIZE // self.record_size * self.record_size)
+        for run_length, offset in self.mft_runlist:
+            if remaining <= 0:
+                break
+            if skip >= run_length:
+                skip -= run_length
+                continue
+            position = skip
+            skip = 0
+            if offset is None:
+                # Records in a sparse run were never written
+                remaining -= run_length - position
+                continue
+            while position < run_length and remaining > 0:
+                length = min(chunk_size, run_length - position, remaining)
+                extents.append((self.start_partition + offset + position, length))
+                position += length
+                remaining -= length
+        return extents
+
+    def read_record(self, record_id, keep_data=False):
+        extents = self.mft_extents(record_id, 1)
+        if not extents:
+            raise ValueError(f"MFT record {record_id} is out of range")
+        offset, length = extents[0]
+        return NTFS_Master_File_Table_Entry(
+            self.partition.device.read(offset, length),
+            self.bytes_per_cluster,
+            self.partition.device,
+            self.start_partition,
+            keep_data,
+        )
+
+    def open_file(self, record_id):
+        """Read-only file object over the unnamed $DATA of a record."""
+        entry = self.read_record(record_id, keep_data=True)
+        if entry.is_folder():
+            raise ValueError(f"MFT record {record_id} is a directory")
+        if "Data" not in entry.attributes:
+            raise ValueError(f"MFT record {record_id} has no data")
+        return entry.attributes["Data"].open()
+
+    def read_record_data(self, record_id, length):
+        # Read through the record's $DATA whichever name it was listed under, the entry may not have kept it
+        with self.open_file(record_id) as file:
+            return file.read(length)
+
+    def read_raw_record(self, record_id):
+        extents = self.mft_extents(record_id, 1)
+        if not extents:
+            raise ValueError(f"MFT record {record_id} is out of range")
+        record = bytearray(self.partition.device.read(*extents[0]))
+        return apply_fixups(record, self.volume_boot_record.number_of_bytes_per_sector)
+
+    def iter_raw_attributes(self, record_id):
+        """Yield (type, name, non-resident flag, bytes) of every attribute in a record."""
+        record = memoryview(self.read_raw_record(record_id))
+        if record[0:4] != b"FILE":
+            raise ValueError(f"MFT record {record_id} is not in use")
+        offset = RECORD_HEADER.unpack_from(record)[1]
+        while offset + ATTRIBUTE_HEADER.size <= len(record):
+            attribute_type, attribute_length, non_resident = ATTRIBUTE_HEADER.unpack_from(record, offset)
+            if attribute_type == 0xFFFFFFFF or attribute_length == 0:
+                break
+            attribute = record[offset : offset + attribute_length]
+            name_length, name_offset = struct.unpack_from("<BH", attribute, 9)
+            name = bytes(attribute[name_offset : name_offset + name_length * 2]).decode("utf-16le")
+            yield attribute_type, name, non_resident, attribute
+            offset += attribute_length
+
+    def attribute_stream(self, attribute):
+        offset_to_runlist, size = NON_RESIDENT_HEADER.unpack_from(attribute, 32)
+        return Data_Stream(
+            self.partition.device,
+            self.start_partition,
+            Cluster_runlist(attribute[offset_to_runlist:], self.bytes_per_cluster).get_runlist(),
+            size,
+        )
+
+    def open_stream(self, record_id, name):
+        """Read-only file object over a named $DATA stream of a record."""
+        for attribute_type, attribute_name, non_resident, attribute in self.iter_raw_attributes(record_id):
+            if attribute_type == 0x80 and attribute_name == name:
+                if non_resident:
+                    return self.attribute_stream(attribute)
+                content_size, content_offset = RESIDENT_HEADER.unpack_from(attribute, 16)
+                return io.BytesIO(bytes(attribute[content_offset : content_offset + content_size]))
+        raise ValueError(f"MFT record {record_id} has no {name} stream")
+
+    def read_index_attributes(self, record_id):
+        # $INDEX_ROOT content and $INDEX_ALLOCATION runlist of the directory's $I30 index
+        index_root = None
+        allocation = Data_Stream(self.partition.device, self.start_partition, [], 0)
+        for attribute_type, name, non_resident, attribute in self.iter_raw_attributes(record_id):
+            if attribute_type == 0x90 and name == "$I30":
+                content_size, content_offset = RESIDENT_HEADER.unpack_from(attribute, 16)
+                index_root = attribute[content_offset : content_offset + content_size]
+            elif attribute_type == 0xA0 and name == "$I30" and non_resident:
+                allocation = self.attribute_stream(attribute)
+        if index_root is None:
+            raise ValueError(f"MFT record {record_id} is not a directory")
+        return index_root, allocation
+
+    def iter_index(self, record_id):
+        """Yield (record id, $FILE_NAME key) for a directory, walking its B+tree in order."""
+        index_root, allocation = self.read_index_attributes(record_id)
+        block_size, clusters_per_block = INDEX_ROOT.unpack_from(index_root)
+        # Child nodes are addressed in clusters, or in 512-byte units when blocks are smaller than a cluster
+        vcn_size = self.bytes_per_cluster if block_size >= self.bytes_per_cluster else 512
+        visited = set()
+
+        def read_block(vcn):
+            if vcn in visited:
+                raise ValueError(f"Index of MFT record {record_id} loops at VCN {vcn}")
+            visited.add(vcn)
+            block = allocation.pread(vcn * vcn_size, block_size)
+            if len(block) < block_size or block[0:4] != b"INDX":
+                raise ValueError(f"Bad index block at VCN {vcn} of MFT record {record_id}")
+            return memoryview(apply_fixups(block, self.volume_boot_record.number_of_bytes_per_sector)), 24
+
+        def walk(node, header):
+            entries_offset, total_size = INDEX_NODE.unpack_from(node, header)
+            offset = header + entries_offset
+            end = min(header + total_size, len(node))
+            while offset + INDEX_ENTRY.size <= end:
+                reference, length, key_length, flags = INDEX_ENTRY.unpack_from(node, offset)
+                # Entries in a child node sort before the entry that points at it
+                if flags & INDEX_ENTRY_SUBNODE:
+                    yield from walk(*read_block(struct.unpack_from("<Q", node, offset + length - 8)[0]))
+                if flags & INDEX_ENTRY_LAST or length == 0:
+                    break
+                yield reference & 0xFFFFFFFFFFFF, node[offset + 16 : offset + 16 + key_length]
+                offset += length
+
+        yield from walk(index_root, 16)
+
+    def read_directory(self, record_id):
+        """Children of a directory built from its index keys, without reading their MFT records."""
+        children = []
+        seen = set()
+        for child_id, key in self.iter_index(record_id):
+            # Short DOS names repeat a file that is already listed under its long name
+            if child_id == record_id or child_id in seen or key[65] == 2:
+                continue
+            seen.add(child_id)
+            file_name = Atribute_File_Name(key)
+            create_value, modify_value, size = INDEX_KEY.unpack_from(key)
+            folder = bool(file_name.flag_value & 0x10000000)
+            children.append(NTFS_MFT_Record(
+                (child_id, record_id, file_name.name, file_name.flag_value, None if folder else size, create_value, modify_value),
+                self,
+            ))
+        return children
+
+    def read_item(self, record_id):
+        """A listed record as its own MFT record has it, its index key holds what it was when its name was last written."""
+        record = NTFS_MFT_Record(self.read_record(record_id).get_record(), self)
+        return get_infomation(record, None if record.is_folder() else record.get_size(), self.number, self.volume_boot_record.total_sectors*512)
+
+    def list_directory(self, record_id, full=False):
+        # full reads every child's own MFT record, for the same details as a full MFT scan
+        entries = self.read_directory(record_id)
+        if full:
+            entries = [self.read_record(entry.get_id()) for entry in entries]
+        return self.get_items(entries)
+
+    def find_usn_journal(self):
+        # $UsnJrnl sits in $Extend (record 11) and only exists once the journal was turned on
+        for entry in self.read_directory(11):
+            if entry.get_file_name() == "$UsnJrnl":
+                return entry.get_id()
+        return None
+
+    def read_journal_position(self):
+        """(journal id, lowest valid USN, next USN) of $UsnJrnl, None when the volume has no journal."""
+        try:
+            record_id = self.find_usn_journal()
+            if record_id is None:
+                return None
+            with self.open_stream(record_id, "$Max") as maximum:
+                journal_id, lowest_usn = USN_JOURNAL.unpack(maximum.read(USN_JOURNAL.size))[2:]
+            with self.open_stream(record_id, "$J") as journal:
+                return journal_id, lowest_usn, journal.seek(0, io.SEEK_END)
+        except (ValueError, struct.error):
+            return None
+
+    def record_journal_position(self):
+        """Let the next refresh replay the change journal from here rather than compare every folder."""
+        self.journal_position = self.read_journal_position()
+
+    def iter_journal(self, since):
+        """Yield (record id, parent record id) of every $UsnJrnl:$J record from USN since."""
+        with self.open_stream(self.find_usn_journal(), "$J") as journal:
+            end = journal.seek(0, io.SEEK_END)
+            position = since
+            base = since
+            data = b""
+            while position < end:
+                offset = position - base
+                if offset + USN_RECORD_HEADER.size <= len(data):
+                    length, major = USN_RECORD_HEADER.unpack_from(data, offset)
+                    if length == 0:
+                        position = (position // USN_PAGE_SIZE + 1) * USN_PAGE_SIZE
+                        continue
+                    if length < USN_RECORD_V2.size or length % 8:
+                        raise ValueError(f"Bad $UsnJrnl record at USN {position}")
+                    if offset + length <= len(data):
+                        record = USN_RECORD_V3 if major >= 3 else USN_RECORD_V2
+                        file_reference, parent_reference = record.unpack_from(data, offset)
+                        yield file_reference & 0xFFFFFFFFFFFF, parent_reference & 0xFFFFFFFFFFFF
+                        position += length
+                        continue
+                # Records are read a chunk at a time, a record cut by the chunk end is read again with the next one
+                data = data[offset:]
+                base = position
+                journal.seek(base + len(data))
+                chunk = journal.read(JOURNAL_CHUNK_SIZE)
+                if not chunk:
+                    break
+                data += chunk
+
+    def refresh(self, records):
+        """Directories among records whose listing may have changed since the last refresh."""
+        serial_number = NTFS_Volume_Boot_Record(self.start_partition, self.partition.device).serial_number
+        if serial_number != self.volume_boot_record.serial_number:
+            raise ValueError("Boot sector changed, the volume was replaced")
+        position, self.journal_position = self.journal_position, self.read_journal_position()
+        # Without both ends of the journal, or when the records in between were dropped, nothing can be ruled out
+        if (
+            position is None or self.journal_position is None
+            or position[0] != self.journal_position[0]
+            or not self.journal_position[1] <= position[2] <= self.journal_position[2]
+        ):
+            return list(records)
+        parents = set()
+        for record_id, parent_id in self.iter_journal(position[2]):
+            parents.add(parent_id)
+        return [record_id for record_id in records if record_id in parents]
+
+    def get_root(self):
+        return {
+            "ID": str(self.number)+"NTFS"+str(5),
+            "Record": 5,
+            "Name": self.volume_name,
+            "Is Folder": True,
+            "Parent ID": None,
+            "Size": None,
+            "Create Time": None,
+            "Modify Time": None,
+            "Data": None,
+            "Attribute": None,
+            "Total Size": self.volume_boot_record.total_sectors*512,
+        }
+
+    def get_items(self, entries):
+        # Folders are listed without a size, it takes everything below them
+        total_size = self.volume_boot_record.total_sectors*512
+        return [
+            get_infomation(entry, None if entry.is_folder() else entry.get_size(), self.number, total_size)
+            for entry in entries
+            if entry.check_file()
+        ]
+
     def get_list_file(self):
         tmp = []
-        tmp.append(
-            {
-                "ID": str(NTFS.counter)+"NTFS"+str(5),
-                "Name": self.volume_name,
-                "Is Folder": True,
-                "Parent ID": None,
-                "Size": None,
-                "Create Time": None,
-                "Modify Time": None,
-                "Data": None,
-                "Attribute": None,
-                "Total Size": self.volume_boot_record.total_sectors*512,
-            }
-        )
+        tmp.append(self.get_root())
         for entry in self.master_file_table:
             if entry.check_file():
-                tmp.append(get_infomation(entry, self.master_file_table, self.volume_name, NTFS.counter, self.volume_boot_record.total_sectors*512))
+                tmp.append(get_infomation(entry, self.tree.get_size(entry.get_id()), self.number, self.volume_boot_record.total_sectors*512))
         return tmp
 
+    def get_identity(self):
+        return "NTFS-%016X-%d-%d" % (
+            self.volume_boot_record.serial_number,
+            self.partition.starting_sector,
+            self.volume_boot_record.total_sectors,
+        )
+
+    def get_fingerprint(self):
+        # Growing the MFT rewrites record 0, and every metadata change is logged, moving the $LogFile LSN
+        lsn, sequence = RECORD_STATE.unpack_from(self.read_raw_record(0))
+        log_lsn = 0
+        with self.open_file(2) as log:
+            position = 0
+            # The newer of the two restart pages holds the current LSN
+            for _ in range(2):
+                log.seek(position)
+                page = log.read(SECTOR_SIZE)
+                if len(page) < RESTART_PAGE.size or page[:4] != b"RSTR":
+                    break
+                page_size, area = RESTART_PAGE.unpack_from(page)
+                log_lsn = max(log_lsn, struct.unpack_from("<Q", page, area)[0])
+                position += page_size
+        return f"{sequence}-{lsn}-{log_lsn}"
+
+    def to_snapshot(self, list_file, unread=()):
+        # unread holds the ids of folders whose children are not in list_file
+        prefix = str(self.number)+"NTFS"
+        rows = []
+        for item in list_file:
+            data = item["Data"]
+            rows.append((
+                item["Record"],
+                int(item["Parent ID"][len(prefix):]) if item["Parent ID"] is not None else None,
+                item["Name"],
+                int(item["Is Folder"]),
+                item["Size"],
+                item["Create Time"],
+                item["Modify Time"],
+                "\n".join(item["Attribute"]) if item["Attribute"] is not None else None,
+                item["Record"],
+                data.size if isinstance(data, FileContent) else None,
+                int(item["ID"] not in unread),
+            ))
+        return rows
+
+    def from_snapshot(self, rows):
+        total_size = self.volume_boot_record.total_sectors*512
+        list_file = []
+        for record_id, parent_id, name, flags, size, create_time, modify_time, attributes, _, text_size, listed in rows:
+            if parent_id is None:
+                root = self.get_root()
+                root["Listed"] = bool(listed)
+                list_file.append(root)
+                continue
+            list_file.append({
+                "ID": str(self.number)+"NTFS"+str(record_id),
+                "Record": record_id,
+                "Name": name,
+                "Is Folder": bool(flags),
+                "Parent ID": str(self.number)+"NTFS"+str(parent_id),
+                "Size": size,
+                "Create Time": create_time,
+                "Modify Time": modify_time,
+                "Data": FileContent(partial(self.read_record_data, record_id), text_size) if text_size is not None else 0,
+                "Attribute": attributes.split("\n") if attributes else [],
+                "Total Size": total_size,
+                "Listed": bool(listed),
+            })
+        return list_file
+
 class NTFS_Volume_Boot_Record:
-    def __init__(self, starting_byte, location_of_disk):
-        fin = open(location_of_disk, "rb")
-        fin.seek(starting_byte)
-        vbr_bytes = fin.read(512)
+    def __init__(self, starting_byte, device):
+        vbr_bytes = device.read(starting_byte, 512)
         self.number_of_bytes_per_sector = int.from_bytes(vbr_bytes[11:13], "little")
         self.number_of_sectors_per_cluster = int.from_bytes(vbr_bytes[13:14], "little")
         self.number_of_sectors_per_track = int.from_bytes(vbr_bytes[24:26], "little")
@@ -172,52 +685,66 @@ class NTFS_Volume_Boot_Record:
         self.starting_cluster_of_mft_mirror = int.from_bytes(vbr_bytes[56:64], "little")
         tmp = int.from_bytes(vbr_bytes[64:65], "little", signed=True)
         self.number_of_bytes_per_entry_in_mft = 2 ** abs(tmp) if tmp < 0 else tmp
-        fin.close()
+        self.serial_number = int.from_bytes(vbr_bytes[72:80], "little")
 
-class Atribute_Standard_Information:
-    def convert_nano_second(self, byte):
-        nano_second = int.from_bytes(byte, "little")
-        timestamp_seconds = (nano_second - WIN_EPOCH) // 10000000
-        date = datetime.fromtimestamp(timestamp_seconds)
-        date_formatted = date.strftime("%A, %B %d, %Y, %I:%M:%S %p")
-        return str(date_formatted)
+def convert_nano_second(nano_second):
+    timestamp_seconds = (nano_second - WIN_EPOCH) // 10000000
+    date = datetime.fromtimestamp(timestamp_seconds)
+    date_formatted = date.strftime("%A, %B %d, %Y, %I:%M:%S %p")
+    return str(date_formatted)
+
+def convert_flag(flag):
+    res = []
+    if flag & 0x0001:
+        res.append("Read Only")
+    if flag & 0x0002:
+        res.append("Hidden")
+    if flag & 0x0004:
+        res.append("System")
+    if flag & 0x0020:
+        res.append("Archive")
+    if flag & 0x10000000:
+        res.append("Directory")
+    return res
 
+class Atribute_Standard_Information:
+    # Timestamps stay raw until they are shown
     def __init__(self, SI_bytes):
-        self.create_time = self.convert_nano_second(SI_bytes[0:8])
-        self.modify_time = self.convert_nano_second(SI_bytes[8:16])
-        self.mft_modify_time = self.convert_nano_second(SI_bytes[16:24])
-        self.access_time = self.convert_nano_second(SI_bytes[24:32])
+        (
+            self.create_value,
+            self.modify_value,
+            self.mft_modify_value,
+            self.access_value,
+        ) = STANDARD_INFORMATION.unpack_from(SI_bytes)
 
-class Atribute_File_Name:
-    def convert_flag(self, byte):
-        flag = int.from_bytes(byte, "little")
-        res = []
-        if flag & 0x0001:
-            res.append("Read Only")
-        if flag & 0x0002:
-            res.append("Hidden")
-        if flag & 0x0004:
-            res.append("System")
-        if flag & 0x0020:
-            res.append("Archive")
-        if flag & 0x10000000:
-            res.append("Directory")
-        return res
+    @property
+    def create_time(self):
+        return convert_nano_second(self.create_value)
+
+    @property
+    def modify_time(self):
+        return convert_nano_second(self.modify_value)
+
+    @property
+    def mft_modify_time(self):
+        return convert_nano_second(self.mft_modify_value)
 
+    @property
+    def access_time(self):
+        return convert_nano_second(self.access_value)
+
+class Atribute_File_Name:
     def __init__(self, FN_bytes):
-        self.parent_id = int.from_bytes(FN_bytes[0:6], "little")
-        self.flag = self.convert_flag(FN_bytes[56:60])
-        self.length_of_name = int.from_bytes(FN_bytes[64:65], "little")
+        parent_reference, self.flag_value, self.length_of_name = FILE_NAME.unpack_from(FN_bytes)
+        # The upper two bytes of a file reference are its sequence number
+        self.parent_id = parent_reference & 0xFFFFFFFFFFFF
+        self.flag = convert_flag(self.flag_value)
         # 1 Character = 2 bytes
-        self.name = FN_bytes[66 : 66 + self.length_of_name * 2].decode("utf-16le")
+        self.name = bytes(FN_bytes[66 : 66 + self.length_of_name * 2]).decode("utf-16le")
         self.extension = self.name.split(".")[-1] if "." in self.name else None
         
 def decode_signed_offset(bytes):
-    if not bytes:
-        return 0
-    sign_byte = bytes[-1]
-    pad = b'\xFF' * (8 - len(bytes)) if sign_byte & 0x80 else b'\x00' * (8 - len(bytes))
-    return int.from_bytes(bytes + pad, 'little', signed=True)
+    return int.from_bytes(bytes, 'little', signed=True)
 
 class Cluster_runlist:
     def __init__(self, runlist_bytes, bytes_per_cluster):
@@ -227,17 +754,24 @@ class Cluster_runlist:
         self.read_runlist()
 
     def read_runlist(self):
-        rbytes = self.runlist_bytes
+        rbytes = memoryview(self.runlist_bytes)
+        position = 0
         real_offset = 0
-        while True:
-            header = int.from_bytes(rbytes[0:1], "little")
+        while position < len(rbytes):
+            header = rbytes[position]
             if not header:
                 break
             length_cluster = header & 0x0F
             offset_cluster = (header >> 4) & 0x0F
-            length = int.from_bytes(rbytes[1 : 1 + length_cluster], "little")
-            offset_bytes = rbytes[1 + length_cluster : 1 + length_cluster + offset_cluster]
-            offset = decode_signed_offset(offset_bytes)
+            position += 1
+            length = int.from_bytes(rbytes[position : position + length_cluster], "little")
+            position += length_cluster
+            # A run without an offset is sparse, it has no clusters on disk
+            if not offset_cluster:
+                self.runlist.append((length * self.bytes_per_cluster, None))
+                continue
+            offset = decode_signed_offset(rbytes[position : position + offset_cluster])
+            position += offset_cluster
             real_offset += offset
             self.runlist.append(
                 (
@@ -245,11 +779,20 @@ class Cluster_runlist:
                     real_offset * self.bytes_per_cluster,
                 )
             )
-            rbytes = rbytes[1 + length_cluster + offset_cluster :]
 
     def get_runlist(self):
         return self.runlist
 
+class Data_Stream(ExtentFile):
+    """Content of a non-resident attribute as a file object, sparse runs read as zeros."""
+
+    def __init__(self, device, start_partition, runlist, size):
+        super().__init__(
+            device,
+            [(None if offset is None else start_partition + offset, run_length) for run_length, offset in runlist],
+            size,
+        )
+
 class Atribute_Data:
     def __init__(
         self,
@@ -259,114 +802,98 @@ class Atribute_Data:
         resident,
         extension,
         bytes_per_cluster,
-        location_of_disk,
+        device,
         start_partition,
+        keep_data=False,
     ):
+        self.device = device
+        self.start_partition = start_partition
+        # Only text files keep their content by default, keep_data keeps it for any file
+        keep_data = keep_data or extension == "txt"
         if resident == 0:
             self.data_size = content_size
-            if extension == "txt":
-                try:
-                    self.data = data_bytes[content_offset : content_offset + content_size].decode()
-                except UnicodeDecodeError:
-                    self.data = data_bytes[content_offset : content_offset + content_size].decode(errors='ignore')
+            if keep_data:
+                self.resident_data = bytes(data_bytes[content_offset : content_offset + content_size])
+                self.data = FileContent(self.read_resident, self.data_size)
                 
         else:
-            self.data_size = int.from_bytes(data_bytes[48:56], "little")
-            if extension == "txt":
-                offset_to_runlist = int.from_bytes(data_bytes[32:34], "little")
-                name_length =  data_bytes[9]
-                offset_to_runlist += name_length*2
+            offset_to_runlist, self.data_size = NON_RESIDENT_HEADER.unpack_from(data_bytes, 32)
+            if keep_data:
                 runlist_bytes = data_bytes[offset_to_runlist:]
-                list_runlist = Cluster_runlist(runlist_bytes, bytes_per_cluster)
-                self.data = ""
-                total = self.data_size
-                for length, offset in list_runlist.get_runlist():
-                    fin = open(location_of_disk, "rb")
-                    fin.seek(start_partition + offset)
-                    if length > total:
-                        length = total
-                    else:
-                        total -= length
-                    tmp = fin.read(length)
-                    try:
-                        self.data += tmp.decode()
-                    except UnicodeDecodeError:
-                        self.data += tmp.decode(errors='ignore')
-                    fin.close()
+                self.runlist = Cluster_runlist(runlist_bytes, bytes_per_cluster).get_runlist()
+                self.stream = Data_Stream(device, start_partition, self.runlist, self.data_size)
+                self.data = FileContent(self.read_runs, self.data_size)
+
+    def read_resident(self, length):
+        return self.resident_data[:length]
+
+    def read_runs(self, length):
+        return self.stream.pread(0, length)
+
+    def open(self):
+        if hasattr(self, "resident_data"):
+            return io.BytesIO(self.resident_data)
+        return Data_Stream(self.device, self.start_partition, self.runlist, self.data_size)
 
 class Attribute_Volume_Name:
     def __init__(self, VN_bytes):
-        self.volume_name = VN_bytes.decode("utf-16le")
+        self.volume_name = bytes(VN_bytes).decode("utf-16le")
 
 class NTFS_Master_File_Table_Entry:
-    def convert_attr_type(self, value):
-        if value == 0x10:
-            return "StandardInformation"
-        elif value == 0x30:
-            return "FileName"
-        elif value == 0x80:
-            return "Data"
-        elif value == 0x60:
-            return "VolumeName"
-        elif value == 0xFFFFFFFF:
-            return "End"
-        return None
-
     def __init__(
-        self, entry_bytes, bytes_per_cluster, location_of_disk, start_partition
+        self, entry_bytes, bytes_per_cluster, device, start_partition, keep_data=False
     ):
         self.start_partition = start_partition
-        self.location_of_disk = location_of_disk
+        self.device = device
+        self.keep_data = keep_data
         self.bytes_per_cluster = bytes_per_cluster
-        self.signature = entry_bytes[0:4].decode("utf-8")
-        self.starting_offset_of_first_attribute = int.from_bytes(
-            entry_bytes[20:22], "little"
-        )
-        self.state = int.from_bytes(entry_bytes[22:24], "little")
-        self.number_of_bytes_in_use = int.from_bytes(entry_bytes[24:28], "little")
-        self.number_of_bytes_of_mft_entry = int.from_bytes(entry_bytes[28:32], "little")
-        self.id_of_mft_entry = int.from_bytes(entry_bytes[44:48], "little")
+        # Attributes are read from views of the record, nothing is copied until it is kept
+        entry_bytes = memoryview(entry_bytes)
+        (
+            signature,
+            self.starting_offset_of_first_attribute,
+            self.state,
+            self.number_of_bytes_in_use,
+            self.number_of_bytes_of_mft_entry,
+            self.id_of_mft_entry,
+        ) = RECORD_HEADER.unpack_from(entry_bytes)
+        self.signature = signature.decode("utf-8")
         self.attributes = {}
-        self.read_attributes(entry_bytes[self.starting_offset_of_first_attribute :])
+        self.read_attributes(entry_bytes, self.starting_offset_of_first_attribute)
 
-    def read_attributes(self, attribute_bytes):
-        while True:
-            attribute_type = self.convert_attr_type(
-                int.from_bytes(attribute_bytes[0:4], "little")
-            )
-            attribute_length = int.from_bytes(attribute_bytes[4:8], "little")
-            resident = int.from_bytes(attribute_bytes[8:9], "little")
-            content_size = 0
-            content_offset = 0
-            if resident == 0:
-                content_size = int.from_bytes(attribute_bytes[16:20], "little")
-                content_offset = int.from_bytes(attribute_bytes[20:22], "little")
-            if attribute_type == "End":
+    def read_attributes(self, entry_bytes, offset):
+        while offset + ATTRIBUTE_HEADER.size <= len(entry_bytes):
+            attribute_type, attribute_length, non_resident = ATTRIBUTE_HEADER.unpack_from(entry_bytes, offset)
+            if attribute_type == 0xFFFFFFFF or attribute_length == 0:
                 break
-            elif attribute_type == "StandardInformation":
-                self.attributes["StandardInformation"] = Atribute_Standard_Information(
-                    attribute_bytes[content_offset : content_offset + content_size]
-                )
-            elif attribute_type == "FileName":
-                self.attributes["FileName"] = Atribute_File_Name(
-                    attribute_bytes[content_offset : content_offset + content_size]
-                )
-            elif attribute_type == "Data":
-                self.attributes["Data"] = Atribute_Data(
-                    attribute_bytes,
-                    content_offset,
-                    content_size,
-                    resident,
-                    self.get_extension(),
-                    self.bytes_per_cluster,
-                    self.location_of_disk,
-                    self.start_partition,
-                )
-            elif attribute_type == "VolumeName":
-                self.attributes["VolumeName"] = Attribute_Volume_Name(
-                    attribute_bytes[content_offset : content_offset + content_size]
-                )
-            attribute_bytes = attribute_bytes[attribute_length:]
+            attribute_type = ATTRIBUTE_TYPES.get(attribute_type)
+            if attribute_type is not None:
+                attribute_bytes = entry_bytes[offset : offset + attribute_length]
+                content_size = 0
+                content_offset = 0
+                if non_resident == 0:
+                    content_size, content_offset = RESIDENT_HEADER.unpack_from(attribute_bytes, 16)
+                content = attribute_bytes[content_offset : content_offset + content_size]
+                if attribute_type == "StandardInformation":
+                    self.attributes["StandardInformation"] = Atribute_Standard_Information(content)
+                elif attribute_type == "FileName":
+                    self.attributes["FileName"] = Atribute_File_Name(content)
+                # Named streams (alternate data streams, $UsnJrnl:$J) are not the file's content
+                elif attribute_type == "Data" and attribute_bytes[9] == 0:
+                    self.attributes["Data"] = Atribute_Data(
+                        attribute_bytes,
+                        content_offset,
+                        content_size,
+                        non_resident,
+                        self.get_extension(),
+                        self.bytes_per_cluster,
+                        self.device,
+                        self.start_partition,
+                        self.keep_data,
+                    )
+                elif attribute_type == "VolumeName":
+                    self.attributes["VolumeName"] = Attribute_Volume_Name(content)
+            offset += attribute_length
 
     def get_file_name(self):
         if "FileName" in self.attributes:
@@ -420,4 +947,65 @@ class NTFS_Master_File_Table_Entry:
     
     def get_attributes(self):
         return self.attributes["FileName"].flag if "FileName" in self.attributes else None
+
+    def get_record(self):
+        information = self.attributes.get("StandardInformation")
+        return (
+            self.get_id(),
+            self.get_parent_id(),
+            self.get_file_name(),
+            self.attributes["FileName"].flag_value,
+            self.get_size(),
+            information.create_value if information else None,
+            information.modify_value if information else None,
+        )
+
+class NTFS_MFT_Record:
+    """Compact record from the parallel MFT scan, with the getters of a full entry."""
+    __slots__ = ("id", "parent_id", "name", "flag", "size", "create_value", "modify_value", "volume")
+
+    def __init__(self, record, volume):
+        self.id, self.parent_id, self.name, self.flag, self.size, self.create_value, self.modify_value = record
+        self.volume = volume
+
+    def get_file_name(self):
+        return self.name
+
+    def get_size(self):
+        return self.size
+
+    def get_extension(self):
+        return self.name.split(".")[-1] if "." in self.name else None
+
+    def is_folder(self):
+        return bool(self.flag & 0x10000000)
+
+    def get_data(self):
+        # The record is read again only when its text is shown
+        if self.size is not None and self.get_extension() == "txt":
+            return FileContent(partial(self.volume.read_record_data, self.id), self.size)
+        return 0
+
+    def get_parent_id(self):
+        return self.parent_id
+
+    def get_id(self):
+        return self.id
+
+    def check_file(self):
+        return not self.flag & 0x0007
+
+    def get_create_time(self):
+        if self.create_value is not None:
+            return convert_nano_second(self.create_value)
+
+    def get_modify_time(self):
+        if self.modify_value is not None:
+            return convert_nano_second(self.modify_value)
+
+    def is_deleted(self):
+        return False
+
+    def get_attributes(self):
+        return convert_flag(self.flag)
     
\ No newline at end of file
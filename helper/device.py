@@ -0,0 +1,207 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+SECTOR_SIZE = 512
+IMAGE_EXTENSIONS = (".img", ".dd")
+# Default size of the block cache kept in front of physical drives
+CACHE_SIZE_MB = 64
+
+class BlockDevice:
+    """Byte-addressed, read-only access to a disk that every parser reads through."""
+    path = None
+    size = None
+
+    def read(self, offset, length):
+        buffer = bytearray(length)
+        count = self.readinto(offset, buffer)
+        return bytes(buffer[:count])
+
+    def view(self, offset, length):
+        # Devices that can hand out their memory directly override this
+        return memoryview(self.read(offset, length))
+
+    def readinto(self, offset, buffer):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RawDevice(BlockDevice):
+    """Physical drive such as \\\\.\\PHYSICALDRIVE1, only ever read in whole sectors."""
+
+    def __init__(self, path, sector_size=SECTOR_SIZE):
+        self.path = path
+        self.sector_size = sector_size
+        self.file = open(path, "rb", buffering=0)
+        self.lock = threading.Lock()
+
+    def _read_exact(self, offset, view):
+        count = 0
+        with self.lock:
+            self.file.seek(offset)
+            while count < len(view):
+                n = self.file.readinto(view[count:])
+                if not n:
+                    break
+                count += n
+        return count
+
+    def readinto(self, offset, buffer):
+        with memoryview(buffer) as view:
+            length = len(view)
+            start = offset - offset % self.sector_size
+            end = -(-(offset + length) // self.sector_size) * self.sector_size
+            if start == offset and end == offset + length:
+                return self._read_exact(offset, view)
+
+            aligned = bytearray(end - start)
+            with memoryview(aligned) as tmp:
+                count = self._read_exact(start, tmp)
+            count = max(0, min(length, count - (offset - start)))
+            view[:count] = aligned[offset - start : offset - start + count]
+            return count
+
+    def close(self):
+        self.file.close()
+
+class ImageDevice(BlockDevice):
+    """Disk image (.img/.dd) mapped into memory, views are zero-copy slices of the mapping."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.memory = memoryview(self.map)
+
+    def view(self, offset, length):
+        return self.memory[offset : offset + length]
+
+    def read(self, offset, length):
+        return self.map[offset : offset + length]
+
+    def readinto(self, offset, buffer):
+        with memoryview(buffer) as view:
+            chunk = self.memory[offset : offset + len(view)]
+            view[: len(chunk)] = chunk
+            return len(chunk)
+
+    def close(self):
+        try:
+            self.memory.release()
+            self.map.close()
+        except BufferError:
+            # Views handed out to parsers are still alive, the mapping goes with them
+            pass
+        self.file.close()
+
+class CachedDevice(BlockDevice):
+    """LRU cache of fixed-size blocks shared by every parser reading the wrapped device."""
+
+    def __init__(self, device, cache_mb=CACHE_SIZE_MB, block_size=64 * 1024, bypass_size=1024 * 1024):
+        self.device = device
+        self.path = device.path
+        self.size = device.size
+        self.block_size = block_size
+        self.capacity = max(1, cache_mb * 1024 * 1024 // block_size)
+        # Reads this large are file contents streaming past, caching them would only evict metadata
+        self.bypass_size = bypass_size
+        self.blocks = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _blocks(self, first, last):
+        found = {}
+        with self.lock:
+            for index in range(first, last + 1):
+                block = self.blocks.get(index)
+                if block is not None:
+                    self.blocks.move_to_end(index)
+                    found[index] = block
+            self.hits += len(found)
+            self.misses += last - first + 1 - len(found)
+
+        # Consecutive missing blocks are fetched with a single read
+        index = first
+        while index <= last:
+            if index in found:
+                index += 1
+                continue
+            end = index
+            while end + 1 <= last and end + 1 not in found:
+                end += 1
+            data = self.device.read(index * self.block_size, (end - index + 1) * self.block_size)
+            with self.lock:
+                for i in range(index, end + 1):
+                    block = data[(i - index) * self.block_size : (i - index + 1) * self.block_size]
+                    found[i] = block
+                    self.blocks[i] = block
+                while len(self.blocks) > self.capacity:
+                    self.blocks.popitem(last=False)
+            index = end + 1
+        return [found[i] for i in range(first, last + 1)]
+
+    def read(self, offset, length):
+        if length <= 0:
+            return b""
+        first, start = divmod(offset, self.block_size)
+        if start + length <= self.block_size:
+            return self._blocks(first, first)[0][start : start + length]
+        return super().read(offset, length)
+
+    def readinto(self, offset, buffer):
+        with memoryview(buffer) as view:
+            length = len(view)
+            if length >= self.bypass_size:
+                return self.device.readinto(offset, view)
+            if not length:
+                return 0
+            first, start = divmod(offset, self.block_size)
+            last = (offset + length - 1) // self.block_size
+            pos = 0
+            for block in self._blocks(first, last):
+                chunk = block[start : start + length - pos]
+                view[pos : pos + len(chunk)] = chunk
+                pos += len(chunk)
+                start = 0
+                if len(block) < self.block_size:
+                    break
+            return pos
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit rate": self.hits / lookups if lookups else 0.0,
+            "cached MB": len(self.blocks) * self.block_size / (1024 * 1024),
+        }
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+
+    def close(self):
+        self.clear()
+        self.device.close()
+
+def open_device(location, cache_mb=CACHE_SIZE_MB):
+    """Open a drive by path, disk images are memory-mapped and physical drives read raw."""
+    if isinstance(location, BlockDevice):
+        return location
+    if location.lower().endswith(IMAGE_EXTENSIONS) or os.path.isfile(location):
+        return ImageDevice(location)
+    device = RawDevice(location)
+    # The OS page cache already serves mapped images, physical drives get our own
+    if cache_mb:
+        device = CachedDevice(device, cache_mb)
+    return device
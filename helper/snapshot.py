@@ -0,0 +1,77 @@
+import os
+import sqlite3
+import threading
+import time
+
+# Columns of a saved listing, their meaning past the name and sizes is up to the file system,
+# listed tells whether the children of a folder were saved with it
+COLUMNS = ("id", "parent", "name", "flags", "size", "created", "modified", "attributes", "locator", "text_size", "listed")
+# Stores written with other columns are dropped, their rows can be read again from the disk
+SCHEMA_VERSION = 2
+
+class Snapshot:
+    """Listings of volumes saved between runs, as far as they were read, keyed by volume identity.
+
+    Each listing is stored with the fingerprint the volume had when it was read,
+    a caller checks that it still matches before trusting the rows.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Volumes read side by side load and save through the same connection, one at a time
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.connection:
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS entries")
+                self.connection.execute("DROP TABLE IF EXISTS volumes")
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS volumes (key TEXT PRIMARY KEY, fingerprint TEXT, saved REAL, count INTEGER)"
+            )
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT, position INTEGER, "
+                + ", ".join(COLUMNS)
+                + ", PRIMARY KEY (key, position)) WITHOUT ROWID"
+            )
+
+    def fingerprint(self, key):
+        with self.lock:
+            return self._fingerprint(key)
+
+    def _fingerprint(self, key):
+        row = self.connection.execute("SELECT fingerprint FROM volumes WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else None
+
+    def load(self, key, fingerprint=None):
+        """Saved rows of a volume, None when there are none or they were saved under another fingerprint."""
+        with self.lock:
+            saved = self._fingerprint(key)
+            if saved is None or (fingerprint is not None and saved != fingerprint):
+                return None
+            return self.connection.execute(
+                "SELECT " + ", ".join(COLUMNS) + " FROM entries WHERE key = ? ORDER BY position", (key,)
+            ).fetchall()
+
+    def save(self, key, fingerprint, rows):
+        rows = list(rows)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO volumes VALUES (?, ?, ?, ?)", (key, fingerprint, time.time(), len(rows))
+            )
+            self.connection.executemany(
+                "INSERT INTO entries VALUES (?, ?" + ", ?" * len(COLUMNS) + ")",
+                ((key, position) + tuple(row) for position, row in enumerate(rows)),
+            )
+
+    def discard(self, key):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self.connection.execute("DELETE FROM volumes WHERE key = ?", (key,))
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
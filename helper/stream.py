@@ -0,0 +1,140 @@
+import io
+import bisect
+
+# Reads smaller than this are rounded up to it, so sequential small reads rarely reach the device
+READAHEAD_SIZE = 128 * 1024
+# Largest single read issued to the device
+IO_SIZE = 4 * 1024 * 1024
+ZERO_BLOCK = bytes(64 * 1024)
+
+class FileContent:
+    """Text of a file, read from disk only when it is asked for."""
+
+    def __init__(self, reader, size):
+        # reader(length) returns the first length bytes of the file
+        self.reader = reader
+        self.size = size
+
+    def read(self, limit=None):
+        length = self.size if limit is None else min(limit, self.size)
+        if length <= 0:
+            return ""
+        return bytes(self.reader(length)).decode(errors="ignore")
+
+    def __bool__(self):
+        return self.size > 0
+
+    def __str__(self):
+        return self.read()
+
+class ExtentFile(io.RawIOBase):
+    """Read-only file over (disk offset, length) extents of a device, extents without an offset read as zeros."""
+
+    def __init__(self, device, extents, size, readahead=READAHEAD_SIZE):
+        self.device = device
+        self.size = size
+        self.readahead = readahead
+        # File position, disk offset and length of each extent
+        self.extents = []
+        position = 0
+        for offset, length in extents:
+            self.extents.append((position, offset, length))
+            position += length
+        self.starts = [extent[0] for extent in self.extents]
+        self.position = 0
+        self.buffer = b""
+        self.buffer_start = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence {whence}")
+        if position < 0:
+            raise ValueError(f"Negative seek position {position}")
+        self.position = position
+        return position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        with memoryview(buffer) as raw, raw.cast("B") as view:
+            if len(view) >= self.readahead:
+                count = self.preadinto(self.position, view)
+            else:
+                start = self.position - self.buffer_start
+                if not 0 <= start < len(self.buffer):
+                    self.buffer = self.pread(self.position, self.readahead)
+                    self.buffer_start = self.position
+                    start = 0
+                count = min(len(view), len(self.buffer) - start)
+                view[:count] = self.buffer[start : start + count]
+        self.position += count
+        return count
+
+    def readall(self):
+        data = self.pread(self.position, max(0, self.size - self.position))
+        self.position += len(data)
+        return bytes(data)
+
+    def preadinto(self, position, buffer):
+        """Fill buffer from position without moving the file position, returns the byte count."""
+        with memoryview(buffer) as view:
+            # Nothing past the file size is returned, the rest of the last cluster is slack
+            length = max(0, min(len(view), self.size - position))
+            filled = 0
+            # Extents that follow each other on disk are read together
+            pending_disk = pending_start = pending_length = None
+            index = max(0, bisect.bisect_right(self.starts, position) - 1)
+            while filled < length and index < len(self.extents):
+                start, disk, extent_length = self.extents[index]
+                skip = position + filled - start
+                count = min(extent_length - skip, length - filled)
+                if count <= 0:
+                    index += 1
+                    continue
+                if pending_disk is not None and (disk is None or pending_disk + pending_length != disk + skip):
+                    if not self.read_extent(pending_disk, view[pending_start : pending_start + pending_length]):
+                        return pending_start
+                    pending_disk = None
+                if disk is None:
+                    for zero in range(filled, filled + count, len(ZERO_BLOCK)):
+                        end = min(zero + len(ZERO_BLOCK), filled + count)
+                        view[zero:end] = ZERO_BLOCK[: end - zero]
+                elif pending_disk is None:
+                    pending_disk, pending_start, pending_length = disk + skip, filled, count
+                else:
+                    pending_length += count
+                filled += count
+                index += 1
+            if pending_disk is not None and not self.read_extent(pending_disk, view[pending_start : pending_start + pending_length]):
+                return pending_start
+            return filled
+
+    def read_extent(self, offset, view):
+        for start in range(0, len(view), IO_SIZE):
+            part = view[start : start + IO_SIZE]
+            if self.device.readinto(offset + start, part) < len(part):
+                return False
+        return True
+
+    def pread(self, position, length):
+        buffer = bytearray(max(0, min(length, self.size - position)))
+        count = self.preadinto(position, buffer)
+        del buffer[count:]
+        return buffer
+
+    def close(self):
+        self.buffer = b""
+        super().close()
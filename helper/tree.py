@@ -0,0 +1,149 @@
+class Tree:
+    """Parent -> children index over entry ids, with folder sizes summed bottom-up.
+
+    A folder added with a size keeps it, one added without gets the total of its
+    children. Once the children of a sized folder change, it keeps the part of its
+    size they did not account for. Folders that are not loaded yet have no size,
+    and neither do the folders above them until they are.
+    """
+
+    def __init__(self):
+        self.parent = {}
+        self.children = {}
+        self.size = {}
+        self.folders = set()
+        self.fixed = set()
+        self.unloaded = set()
+        # Sized folder -> part of its size not covered by its children
+        self.extra = {}
+
+    def add(self, node_id, parent_id, size=None, is_folder=False, loaded=True):
+        # A node that names itself as parent (the NTFS root) is a root
+        if parent_id == node_id:
+            parent_id = None
+        self.parent[node_id] = parent_id
+        self.children.setdefault(parent_id, []).append(node_id)
+        self.size[node_id] = size
+        if is_folder:
+            self.folders.add(node_id)
+            if size is not None:
+                self.fixed.add(node_id)
+            if not loaded:
+                self.unloaded.add(node_id)
+        elif size is None:
+            self.size[node_id] = 0
+
+    def roots(self):
+        return [node for node, parent in self.parent.items() if parent is None or parent not in self.parent]
+
+    def get_size(self, node_id):
+        return self.size.get(node_id)
+
+    def get_children(self, node_id):
+        return self.children.get(node_id, [])
+
+    def child_count(self, node_id):
+        return len(self.children.get(node_id, ()))
+
+    def _total(self, node_id):
+        if node_id in self.fixed:
+            extra = self.extra.get(node_id)
+            if extra is None:
+                return self.size[node_id]
+            total = self._sum(node_id)
+            return None if total is None else extra + total
+        if node_id in self.unloaded:
+            return None
+        return self._sum(node_id)
+
+    def _sum(self, node_id):
+        total = 0
+        for child in self.children.get(node_id, ()):
+            size = self.size[child]
+            if size is None:
+                return None
+            total += size
+        return total
+
+    def aggregate(self, roots=None):
+        """Compute every folder's size in a single post-order pass, or only those below roots."""
+        order = []
+        stack = self.roots() if roots is None else list(roots)
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(self.children.get(node, ()))
+        # Reversed pre-order visits every child before its parent
+        for node in reversed(order):
+            if node in self.folders:
+                self.size[node] = self._total(node)
+
+    def set_sizes(self, sizes):
+        """Give nodes added before their sizes were known the sizes they were read with, aggregate then fills in the rest."""
+        for node_id, size in sizes.items():
+            if node_id not in self.parent:
+                continue
+            if node_id in self.folders:
+                self.size[node_id] = size
+                if size is not None:
+                    self.fixed.add(node_id)
+            else:
+                self.size[node_id] = 0 if size is None else size
+
+    def _settle(self, node_id):
+        # Sized folders above a change remember what their children leave out, before the children change
+        while node_id is not None and node_id in self.parent:
+            if node_id in self.fixed and node_id not in self.extra:
+                total = self._sum(node_id)
+                self.extra[node_id] = None if total is None or self.size[node_id] is None else self.size[node_id] - total
+            node_id = self.parent[node_id]
+
+    def _propagate(self, node_id):
+        # Recompute the folder and its ancestors, stopping once a size no longer changes
+        changed = []
+        while node_id is not None and node_id in self.parent:
+            if node_id in self.folders:
+                size = self._total(node_id)
+                if size == self.size[node_id] and changed:
+                    break
+                self.size[node_id] = size
+                changed.append(node_id)
+            node_id = self.parent[node_id]
+        return changed
+
+    def attach(self, parent_id, nodes):
+        """Add the children of a folder that was just loaded, returns ids whose size changed.
+
+        nodes holds (id, size, is_folder, loaded) tuples.
+        """
+        self._settle(parent_id)
+        self.unloaded.discard(parent_id)
+        for node_id, size, is_folder, loaded in nodes:
+            self.add(node_id, parent_id, size, is_folder, loaded)
+        return self._propagate(parent_id)
+
+    def remove(self, node_id):
+        """Drop a node and everything below it, returns ids whose size changed."""
+        parent_id = self.parent.get(node_id)
+        self._settle(parent_id)
+        stack = [node_id]
+        while stack:
+            node = stack.pop()
+            stack.extend(self.children.pop(node, ()))
+            self.parent.pop(node, None)
+            self.size.pop(node, None)
+            self.folders.discard(node)
+            self.fixed.discard(node)
+            self.unloaded.discard(node)
+            self.extra.pop(node, None)
+        siblings = self.children.get(parent_id)
+        if siblings is not None and node_id in siblings:
+            siblings.remove(node_id)
+        return self._propagate(parent_id)
+
+    def resize(self, node_id, size):
+        """Change the size of a file, returns ids whose size changed."""
+        parent_id = self.parent.get(node_id)
+        self._settle(parent_id)
+        self.size[node_id] = size
+        return [node_id] + self._propagate(parent_id)
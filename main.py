@@ -1,11 +1,23 @@
 import os
-import wmi
+import sys
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 from PIL import Image, ImageTk
 import math
+import queue
+import bisect
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from helper.NTFS import *
 from helper.FAT32 import *
+from helper.device import open_device
+from helper.stream import FileContent
+from helper.tree import Tree
+from helper.snapshot import Snapshot
 SECTOR_SIZE = 512
 # Dèfine extention with multiple types 
 AUDIO_EXTENSIONS = {'.mp3', '.wav', '.flac', '.aac', '.ogg', '.wma', '.m4a', '.aiff', '.alac', '.opus', '.amr', '.mid', '.midi'}
@@ -20,6 +32,25 @@ RAR_EXTENSIONS = {'.rar'}
 EXECUTABLE_EXTENSIONS = {'.exe', '.msi', '.bat', '.cmd', '.ps1', '.sh'}
 VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.wmv', '.flv', '.mkv', '.webm'}
 CODE_EXTENSIONS = {'.py', '.java', '.cpp', '.c', '.h', '.js', '.php', '.html', '.css', '.json', '.xml'}
+# Folders are read when first expanded instead of walking the whole volume up front,
+# NTFS ones through their directory index instead of a full MFT scan
+LAZY_LOADING = True
+# Only this much of a file is read for the content tab
+PREVIEW_SIZE = 1024 * 1024
+# Processes parsing the MFT of large NTFS volumes
+MFT_WORKERS = os.cpu_count()
+# Listings of volumes, as far as they were read, are kept here and shown on the next start, None turns this off
+SNAPSHOT_PATH = os.path.join(os.path.expanduser("~"), ".file_explorer", "snapshots.db")
+# Milliseconds between checks for volumes read in the background
+POLL_INTERVAL = 100
+# Messages from the background read handled per check, the rest wait for the next one
+POLL_MESSAGES = 50
+# Entries of a volume loaded from a snapshot are handed to the window this many at a time
+ENTRY_BATCH = 2000
+# Children of an opened folder are inserted this many at a time, between them the window stays responsive
+INSERT_BATCH = 500
+# Children shown before a "load more" row, selecting it shows as many again
+FOLDER_WINDOW = 5000
 
 # Data using for display GUI 
 class Entry:
@@ -35,17 +66,79 @@ class Entry:
         self.attributes = attributes
         self.file_system = file_system
         self.size_of_disk = size_of_disk
+        # Returns the children of a folder that has not been read yet
+        self.loader = None
+        # Start cluster (FAT32) or MFT record (NTFS) the entry was read from
+        self.locator = None
+        # Returns what the entry's own record holds when it was listed from a folder index that may be out of date
+        self.details = None
+        # Order among the children of a folder, folders first and then by name
+        self.sort_key = (not is_folder, (name or "").casefold())
+
+class ScanCancelled(Exception):
+    pass
+
+class Scan:
+    """A read of the disk running in a worker thread, what it reads is handed to the window through queue."""
+
+    def __init__(self, validate=False, notify=False):
+        self.queue = queue.Queue()
+        self.cancelled = threading.Event()
+        # Whether snapshots are checked, and a message shown, once it is done
+        self.validate = validate
+        self.notify = notify
+        self.lock = threading.Lock()
+        self.records = 0
+        self.bytes = 0
+        # Bytes the parsers are known to have ahead of them, the progress bar runs up to it
+        self.expected = 0
+        self.total = 0
+        self.loaded = 0
+        # Partition numbers of the volumes shown so far, keeps them in disk order
+        self.shown = []
+        # Keys of snapshots found out of date, and whether a refresh gave up and the disk is read again
+        self.stale = []
+        self.reload = False
+        # Volumes a refresh compares with the disk, they are only handed back once all it found is patched in
+        self.refreshed = None
+
+    def expect(self, size):
+        with self.lock:
+            self.expected += size
+
+    def report(self, records, size):
+        # Called by the parsers from the worker threads, stopping them is how a scan is cancelled
+        if self.cancelled.is_set():
+            raise ScanCancelled()
+        with self.lock:
+            self.records += records
+            self.bytes += size
 
 class App:
-    def __init__(self, root, entries):
+    def __init__(self, root, entries, location=None):
         # window 
         self.root = root
+        # Drive or disk image to read, None picks the removable drive through WMI
+        self.location = location
+        # Shared by every volume of the disk, the block cache in front of it serves them all
+        self.device = None
+        self.snapshot = None
+        # Root entry id -> (volume, whether every folder of it was read up front), for refresh
+        self.volumes = {}
+        # Counts refreshes, keeps ids of entries added by one apart from those of the next
+        self.generation = 0
+        # Volume read lazily or from a snapshot -> [key, fingerprint, items listed so far, whether items grew since
+        # they were saved], written to the snapshot when the volume is let go
+        self.listings = {}
+        # Read of the disk still running in the background
+        self.scan = None
+        # Held by a refresh while it reads a volume in the background, folders opened meanwhile are read once it is done
+        self.volume_lock = threading.Lock()
         self.root.title("[23127115 - 23127334] File Explorer")
         self.root.geometry("900x600")
         self.root.configure(bg="white")
 
-        self.entries = entries
-        self.entry_dict = {entry.id: entry for entry in entries}
+        self.set_entries(entries)
         
         # Label for display information of file 
         self.labels = {
@@ -60,6 +153,7 @@ class App:
         self.load_icons()
         self.create_main_ui()
         self.initial()
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
 
     # Set up GUI styling
     def configure_style(self):
@@ -134,6 +228,25 @@ class App:
         self.video_icon = ImageTk.PhotoImage(video_img)
         self.code_icon = ImageTk.PhotoImage(code_img)
 
+        # Extension -> icon, an extension listed in several groups keeps the first one
+        self.extension_icons = {}
+        for extensions, icon in (
+            (AUDIO_EXTENSIONS, self.audio_icon),
+            (IMAGE_EXTENSIONS, self.image_icon),
+            (PDF_EXTENSIONS, self.pdf_icon),
+            (WORD_EXTENSIONS, self.word_icon),
+            (EXCEL_EXTENSIONS, self.excel_icon),
+            (PPTX_EXTENSIONS, self.powerpoint_icon),
+            (TEXT_EXTENSIONS, self.text_icon),
+            (ZIP_EXTENSIONS, self.zip_icon),
+            (RAR_EXTENSIONS, self.rar_icon),
+            (EXECUTABLE_EXTENSIONS, self.executable_icon),
+            (VIDEO_EXTENSIONS, self.video_icon),
+            (CODE_EXTENSIONS, self.code_icon),
+        ):
+            for ext in extensions:
+                self.extension_icons.setdefault(ext, icon)
+
     # Divise main background into panels 
     def create_main_ui(self):
 
@@ -159,6 +272,16 @@ class App:
         # Add treeview below button
         self.tree = ttk.Treeview(self.tree_frame)
         self.tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0,5))
+
+        # Progress of a read running in the background, shown above the tree while it lasts
+        self.progress_frame = tk.Frame(self.tree_frame, bg="white")
+        self.progress_label = tk.Label(self.progress_frame, text="", anchor='w', bg="white", font=("Segoe UI", 9))
+        self.progress_label.grid(row=0, column=0, columnspan=2, sticky='ew')
+        self.progress_bar = ttk.Progressbar(self.progress_frame, mode='determinate')
+        self.progress_bar.grid(row=1, column=0, sticky='ew')
+        self.cancel_btn = ttk.Button(self.progress_frame, text="Cancel", command=self.cancel_scan, style="TButton")
+        self.cancel_btn.grid(row=1, column=1, padx=(5, 0))
+        self.progress_frame.columnconfigure(0, weight=1)
         # binld event with act 
         self.tree.bind("<<TreeviewOpen>>", self.on_folder_open)
         self.tree.bind("<<TreeviewClose>>", self.on_folder_close)
@@ -203,46 +326,39 @@ class App:
         self.paned_window.add(self.tree_frame)
         self.paned_window.add(self.detail_frame)
 
+    def set_entries(self, entries):
+        self.entry_dict = {}
+        # Parent -> children index of the entries with their folder sizes, kept up to date as folders are opened
+        self.sizes = Tree()
+        # Opened folder -> children not inserted into the Treeview yet, and "load more" row -> its folder
+        self.pending = {}
+        self.more = {}
+        self.merge_entries(entries)
+
+    def merge_entries(self, entries):
+        """Add the entries of whole volumes, their roots included."""
+        self.entry_dict.update((entry.id, entry) for entry in entries)
+        for entry in entries:
+            self.sizes.add(entry.id, entry.parentId, entry.size, entry.is_folder, entry.loader is None)
+        # Folders read in full but handed over without a size (the NTFS root) get the total of their children
+        self.sizes.aggregate(entry.id for entry in entries if entry.parentId is None)
+        for entry in entries:
+            if entry.is_folder:
+                entry.size = self.sizes.get_size(entry.id)
+
     def initial(self):
-        for entry in self.entries:
-            if entry.parentId is None:
-                self.add_entry('', entry)
+        for root_id in self.sizes.get_children(None):
+            self.add_entry('', self.entry_dict[root_id])
 
     def get_file_icon(self, filename):
         """Return the appropriate icon based on file extension"""
         _, ext = os.path.splitext(filename.lower())
-        
-        if ext in AUDIO_EXTENSIONS:
-            return self.audio_icon
-        elif ext in IMAGE_EXTENSIONS:
-            return self.image_icon
-        elif ext in PDF_EXTENSIONS:
-            return self.pdf_icon
-        elif ext in WORD_EXTENSIONS:
-            return self.word_icon
-        elif ext in EXCEL_EXTENSIONS    :
-            return self.excel_icon
-        elif ext in PPTX_EXTENSIONS:
-            return self.powerpoint_icon
-        elif ext in TEXT_EXTENSIONS:
-            return self.text_icon
-        elif ext in ZIP_EXTENSIONS:
-            return self.zip_icon
-        elif ext in RAR_EXTENSIONS:
-            return self.rar_icon
-        elif ext in EXECUTABLE_EXTENSIONS:
-            return self.executable_icon
-        elif ext in VIDEO_EXTENSIONS:
-            return self.video_icon
-        elif ext in CODE_EXTENSIONS:
-            return self.code_icon
-        else:
-            return self.file_icon  # Default icon
+        return self.extension_icons.get(ext, self.file_icon)
 
-    def add_entry(self, parent, entry):
+    def add_entry(self, parent, entry, index='end'):
         if entry.is_folder:
-            # Check if folder has children
-            has_children = any(subentry.parentId == entry.id for subentry in self.entries)
+            # Check if folder has children, unread folders are assumed to have some
+            has_children = entry.loader is not None or self.sizes.child_count(entry.id) > 0
             
             if entry.attributes is None:  # This is a partition
                 # Choose icon based on file system
@@ -251,10 +367,10 @@ class App:
                 else:
                     icon = self.fat32_partition_icon
                 
-                item = self.tree.insert(parent, 'end', entry.id, text=f" {entry.name}",
+                item = self.tree.insert(parent, index, entry.id, text=f" {entry.name}",
                                       values=('partition',), image=icon)
             else:  # Regular folder
-                item = self.tree.insert(parent, 'end', entry.id, text=f" {entry.name}",
+                item = self.tree.insert(parent, index, entry.id, text=f" {entry.name}",
                                       values=('folder',), image=self.collapse_folder_icon)
             
             # Only add dummy child if folder has children
@@ -263,16 +379,18 @@ class App:
         else:
             # Get the appropriate icon based on file extension
             icon = self.get_file_icon(entry.name)
-            self.tree.insert(parent, 'end', entry.id, text=f" {entry.name}",
+            self.tree.insert(parent, index, entry.id, text=f" {entry.name}",
                            values=('file',), image=icon)
 
     def on_folder_open(self, event):
         item = self.tree.focus()
         if not item:
             return
+        self.open_folder(item)
 
+    def open_folder(self, item):
         entry = self.entry_dict.get(item)
-        if not entry or not entry.is_folder:
+        if not entry or not entry.is_folder or not self.tree.exists(item):
             return
 
         # Change icon to expanded folder (only for regular folders, not partitions)
@@ -282,13 +400,99 @@ class App:
         # Check if this is the first time opening (has dummy child)
         children = self.tree.get_children(item)
         if len(children) == 1 and not self.tree.item(children[0], 'values'):
+            # Read the folder from disk if it was not loaded with the rest of the volume
+            if entry.loader is not None:
+                # A refresh is reading the volume, the folder is read once it lets go instead of holding up the window
+                if not self.volume_lock.acquire(blocking=False):
+                    self.root.after(POLL_INTERVAL, self.open_folder, item)
+                    return
+                try:
+                    changed = self.load_children(entry)
+                except Exception as e:
+                    # The dummy child stays, so the folder can be expanded to try again
+                    self.tree.item(item, open=False)
+                    if entry.attributes is not None:
+                        self.tree.item(item, image=self.collapse_folder_icon)
+                    messagebox.showerror("Read Error", f"An error occurred while reading the folder:\n{str(e)}")
+                    return
+                finally:
+                    self.volume_lock.release()
+                self.update_sizes(changed)
+                if entry.id in changed:
+                    self.show_entry_info()
+
             # Remove dummy child
             self.tree.delete(children[0])
             
-            # Add real children
-            for subentry in self.entries:
-                if subentry.parentId == entry.id:
-                    self.add_entry(item, subentry)
+            # Add real children, sorted once here and inserted a batch at a time
+            children = sorted(self.sizes.get_children(entry.id), key=lambda child_id: self.entry_dict[child_id].sort_key)
+            pending = self.pending[item] = deque(children)
+            self.insert_children(item, pending, FOLDER_WINDOW)
+
+    def insert_children(self, folder_id, pending, budget):
+        """Insert up to budget more children of an opened folder, a batch now and the rest when the window is idle."""
+        # The folder was refreshed or removed since this was scheduled
+        if self.pending.get(folder_id) is not pending or not self.tree.exists(folder_id):
+            return
+        count = 0
+        while pending and count < min(budget, INSERT_BATCH):
+            child = self.entry_dict.get(pending.popleft())
+            # Removed or moved elsewhere by a refresh
+            if child is None or child.parentId != folder_id or self.tree.exists(child.id):
+                continue
+            self.add_entry(folder_id, child)
+            count += 1
+        budget -= count
+        if not pending:
+            del self.pending[folder_id]
+        elif budget > 0:
+            self.root.after_idle(self.insert_children, folder_id, pending, budget)
+        else:
+            more = self.tree.insert(folder_id, 'end', text=f" Load {len(pending):,} more...", values=('more',))
+            self.more[more] = folder_id
+
+    def load_more(self, item):
+        folder_id = self.more.pop(item)
+        self.tree.delete(item)
+        self.insert_children(folder_id, self.pending[folder_id], FOLDER_WINDOW)
+
+    def place_children(self, folder_id, new_entries):
+        """Show entries added to an opened folder where they sort among the children shown."""
+        shown = [child for child in self.tree.get_children(folder_id) if child in self.entry_dict]
+        keys = [self.entry_dict[child].sort_key for child in shown]
+        pending = self.pending.get(folder_id)
+        late = []
+        for new in sorted(new_entries, key=lambda entry: entry.sort_key):
+            index = bisect.bisect(keys, new.sort_key)
+            # Past the children shown so far, it is inserted with the rest of them
+            if pending is not None and index == len(keys):
+                late.append(new.id)
+                continue
+            self.add_entry(folder_id, new, index)
+            keys.insert(index, new.sort_key)
+        if late:
+            merged = sorted(list(pending) + late, key=lambda child_id: self.entry_dict[child_id].sort_key)
+            pending.clear()
+            pending.extend(merged)
+            for more, owner in self.more.items():
+                if owner == folder_id:
+                    self.tree.item(more, text=f" Load {len(pending):,} more...")
+
+    def load_children(self, entry):
+        """Run the loader of a folder and add what it read, returns ids whose size changed."""
+        # Called with volume_lock held
+        new_entries = entry.loader()
+        entry.loader = None
+        return self.add_entries(entry.id, new_entries)
+
+    def add_entries(self, parent_id, new_entries):
+        self.entry_dict.update((subentry.id, subentry) for subentry in new_entries)
+        return self.sizes.attach(parent_id, [(subentry.id, subentry.size, subentry.is_folder, subentry.loader is None) for subentry in new_entries])
+
+    def update_sizes(self, changed):
+        for folder_id in changed:
+            if folder_id in self.entry_dict:
+                self.entry_dict[folder_id].size = self.sizes.get_size(folder_id)
 
     def on_folder_close(self, event):
         item = self.tree.focus()
@@ -307,13 +511,18 @@ class App:
         item = self.tree.focus()
         if not item:
             return
+        if item in self.more:
+            self.load_more(item)
+            return
 
         entry = self.entry_dict.get(item)
         if not entry:
             return
+        if entry.details is not None:
+            self.read_details(entry)
 
-        created = str(entry.created_date)
-        modified = str(entry.modified_date)
+        created = self.format_date(entry.created_date)
+        modified = self.format_date(entry.modified_date)
 
         self.labels['name'].config(text=f"Name:           {entry.name}")
         strAttr = ""
@@ -322,7 +531,7 @@ class App:
             self.labels['attributes'].config(text=f"File system:    {strAttr}")
             raw_size = format(entry.size_of_disk, ",") if entry.size_of_disk is not None else "N/A"
             self.labels['created'].config(text=f"Total size:      {self.format_size(entry.size_of_disk)} ({raw_size} Bytes)")
-            self.labels['modified'].config(text="")
+            self.labels['modified'].config(text=self.cache_text(entry))
             self.labels['size'].config(text="")
         else:
             strAttr = " ".join(entry.attributes)
@@ -345,17 +554,61 @@ class App:
         self.content_text.config(state='disabled')
         self.notebook.select(self.info_tab)
 
+    def read_details(self, entry):
+        """Show a lazily listed entry with what its own record holds, read once it is selected."""
+        # A refresh reading the volume is not waited for, the listed values are shown until it is selected again
+        if not self.volume_lock.acquire(blocking=False):
+            return
+        try:
+            item = entry.details()
+        except Exception:
+            return
+        finally:
+            self.volume_lock.release()
+        entry.details = None
+        entry.created_date = item["Create Time"]
+        entry.modified_date = item["Modify Time"]
+        entry.attributes = item["Attribute"]
+        if not entry.is_folder:
+            entry.content = item["Data"]
+            if entry.size != item["Size"]:
+                entry.size = item["Size"]
+                self.update_sizes(self.sizes.resize(entry.id, item["Size"]))
+
+    def cache_text(self, entry):
+        # Physical drives are read through the block cache, images have none
+        volume = self.volumes.get(entry.id, (None,))[0]
+        if volume is None:
+            return ""
+        device = volume.device if isinstance(volume, FAT32) else volume.partition.device
+        if not hasattr(device, "stats"):
+            return ""
+        stats = device.stats()
+        return (f"Block cache:   {stats['hit rate']:.1%} hits ({stats['hits']:,} of {stats['hits'] + stats['misses']:,} blocks), "
+                f"{stats['cached MB']:.1f} MB cached")
+
     def show_file_content(self, entry):
         self.content_text.config(state='normal')
         self.content_text.delete(1.0, tk.END)
 
-        if entry.content:
+        if isinstance(entry.content, FileContent):
+            # Content is read from disk here, only up to the preview size
+            self.content_text.insert(tk.END, entry.content.read(PREVIEW_SIZE))
+            if entry.content.size > PREVIEW_SIZE:
+                self.content_text.insert(tk.END, f"\n\n[Showing the first {self.format_size(PREVIEW_SIZE)} of {self.format_size(entry.content.size)}]")
+        elif entry.content:
             self.content_text.insert(tk.END, entry.content)
         else:
             self.content_text.insert(tk.END, "")
 
         self.content_text.config(state='disabled')
 
+    def format_date(self, date):
+        # FAT32 hands over datetimes, they are only formatted once shown
+        if isinstance(date, datetime):
+            return date.strftime("%A, %B %d, %Y, %I:%M:%S %p")
+        return str(date)
+
     def format_size(self, size):
         if size is None:
             return "N/A"
@@ -368,96 +621,555 @@ class App:
     def refresh_data(self):
         """Refresh the data and reload the UI"""
         try:
-            for item in self.tree.get_children():
-                self.tree.delete(item)
-                
-            new_entries = self.get_disk_data()
-            self.entries = new_entries
-            self.entry_dict = {entry.id: entry for entry in new_entries}
-            
-            self.initial()
-            
             for label in self.labels.values():
                 label.config(text="")
             self.content_text.config(state='normal')
             self.content_text.delete(1.0, tk.END)
             self.content_text.config(state='disabled')
-            
-            messagebox.showinfo("Refresh Complete", "Data has been refreshed successfully")
+
+            # A read still running is started over instead of patched, the message is shown once it is done
+            if self.scan is None and self.volumes:
+                self.refresh_volumes()
+            else:
+                self.load_disk_data(validate=True, notify=True)
         except Exception as e:
             messagebox.showerror("Refresh Error", f"An error occurred while refreshing data:\n{str(e)}")
 
-    def get_disk_data(self):
-        """Function to get disk data (same as main logic)"""
-        c = wmi.WMI()
+    def refresh_volumes(self):
+        """Compare the folders read so far with the disk in the background, those that changed are patched in as they come."""
+        # Whatever the block cache holds may be out of date
+        if hasattr(self.device, "clear"):
+            self.device.clear()
+        self.generation += 1
+        work = []
+        for root_id, (volume, full) in self.volumes.items():
+            # Only folders whose children were read can be compared with the disk
+            folders = {}
+            stack = [root_id]
+            while stack:
+                entry = self.entry_dict[stack.pop()]
+                if entry.is_folder and entry.loader is None:
+                    folders[entry.locator] = entry
+                    stack.extend(self.sizes.get_children(entry.id))
+            work.append((volume, full, folders))
+        scan = self.start_scan(Scan(notify=True), "Checking for changes...")
+        # Cancelled or failed part way, the next refresh reads the whole disk instead
+        scan.refreshed, self.volumes = self.volumes, {}
+        threading.Thread(target=self.refresh_disk, args=(scan, work), daemon=True).start()
+
+    def refresh_disk(self, scan, work):
+        # Worker thread, folders that changed are listed again here and patched into the tree by the window
+        try:
+            for volume, full, folders in work:
+                with self.volume_lock:
+                    for locator in volume.refresh(list(folders)):
+                        if scan.cancelled.is_set():
+                            return
+                        folder = folders[locator]
+                        new_entries = self.list_folder(volume, folder, full)
+                        subtrees = self.read_ahead(folder, new_entries, folders) if full else {}
+                        scan.queue.put(("patch", folder, new_entries, subtrees))
+        except (OSError, ValueError, IndexError, KeyError):
+            # The changes cannot be patched in, the disk is read again once this is done
+            scan.queue.put(("reload", None))
+        except Exception as error:
+            scan.queue.put(("error", error))
+            return
+        scan.queue.put(("done", None))
+
+    def patch_changed(self, folder, new_entries, subtrees):
+        # Gone with a folder above it that was patched first
+        if self.entry_dict.get(folder.id) is folder:
+            self.update_sizes(self.patch_folder(folder, new_entries, subtrees))
+
+    def read_ahead(self, folder, new_entries, folders):
+        """Read the folders new to a volume read up front in full, returns their children by folder id."""
+        pending = []
+        for entry in new_entries:
+            known = folders.get(entry.locator)
+            # One read already under the same name keeps its children, its own refresh brings their changes
+            if entry.loader is not None and (known is None or known.parentId != folder.id or known.name != entry.name):
+                pending.append(entry)
+        subtrees = {}
+        while pending:
+            entry = pending.pop()
+            children = entry.loader()
+            entry.loader = None
+            subtrees[entry.id] = children
+            pending.extend(child for child in children if child.loader is not None)
+        return subtrees
+
+    def list_folder(self, volume, folder, full):
+        if isinstance(volume, NTFS):
+            return self.ntfs_entries(volume, volume.list_directory(folder.locator), True)
+        # Ids of new entries are made under a name of their own, the old ones are still in use
+        items = volume.listDirectory(folder.locator, f"{folder.id}~{self.generation}")
+        for item in items:
+            item["Parent"] = folder.id
+        return self.fat32_entries(volume, items, True)
+
+    def patch_folder(self, folder, new_entries, subtrees):
+        """Bring the children of a read folder in line with a new listing of it, returns ids whose size changed."""
+        old = {}
+        for child_id in self.sizes.get_children(folder.id):
+            child = self.entry_dict[child_id]
+            old[(child.name, child.is_folder, child.locator)] = child
+        changed = set()
+        added = []
+        for new in new_entries:
+            current = old.pop((new.name, new.is_folder, new.locator), None)
+            if current is None:
+                added.append(new)
+                continue
+            current.created_date = new.created_date
+            current.modified_date = new.modified_date
+            current.content = new.content
+            current.attributes = new.attributes
+            current.details = new.details
+            if not current.is_folder and current.size != new.size:
+                current.size = new.size
+                changed.update(self.sizes.resize(current.id, new.size))
+        for stale in old.values():
+            changed.update(self.remove_entry(stale.id))
+        # The same id elsewhere is the same MFT record, moved here
+        for new in added:
+            if new.id in self.entry_dict:
+                changed.update(self.remove_entry(new.id))
+        changed.update(self.add_entries(folder.id, added))
+
+        # Volumes read up front get new folders in full as well, read along with the listing
+        pending = [new for new in added if new.id in subtrees]
+        while pending:
+            entry = pending.pop()
+            children = subtrees[entry.id]
+            changed.update(self.add_entries(entry.id, children))
+            pending.extend(child for child in children if child.id in subtrees)
+
+        # Items of a folder still showing its placeholder are added when it is opened
+        if self.tree.exists(folder.id):
+            children = self.tree.get_children(folder.id)
+            if not (len(children) == 1 and not self.tree.item(children[0], 'values')):
+                self.place_children(folder.id, added)
+        return changed
+
+    def remove_entry(self, entry_id):
+        # The entry goes with everything below it
+        stack = [entry_id]
+        while stack:
+            node = stack.pop()
+            self.entry_dict.pop(node, None)
+            stack.extend(self.sizes.get_children(node))
+        if self.tree.exists(entry_id):
+            self.tree.delete(entry_id)
+        return self.sizes.remove(entry_id)
+
+    def load_disk_data(self, validate=False, notify=False):
+        """Read the disk again in a worker thread, volumes show up in the tree as they are read."""
+        if self.scan is not None:
+            self.scan.cancelled.set()
+        for item in self.tree.get_children():
+            self.tree.delete(item)
+        self.set_entries([])
+        self.reset_volumes()
+        # WMI is only used from the thread it was set up on
+        location = self.find_location(self.location)
+        try:
+            device = self.device = open_device(location)
+        except OSError as e:
+            messagebox.showerror("Loading Error", f"An error occurred while reading the disk:\n{str(e)}")
+            return
+
+        scan = self.start_scan(Scan(validate, notify), "Reading partition table...")
+        threading.Thread(target=self.scan_disk, args=(scan, device), daemon=True).start()
+
+    def start_scan(self, scan, text):
+        self.scan = scan
+        self.progress_bar.config(mode='determinate', value=0, maximum=1)
+        self.progress_label.config(text=text)
+        self.progress_frame.pack(side=tk.TOP, fill=tk.X, padx=5, pady=(0, 5), before=self.tree)
+        self.root.after(POLL_INTERVAL, self.poll_scan, scan)
+        return scan
+
+    def scan_disk(self, scan, device):
+        # Worker thread, nothing in here touches the window or the entries shown in it
+        try:
+            partitions = list_partitions(device)
+            scan.queue.put(("partitions", len(partitions)))
+            unverified = self.read_volumes(partitions, device, scan)
+            if scan.validate:
+                scan.queue.put(("stale", self.validate_snapshots(unverified)))
+        except ScanCancelled:
+            return
+        except Exception as error:
+            scan.queue.put(("error", error))
+            return
+        scan.queue.put(("done", None))
+
+    def poll_scan(self, scan):
+        # Messages of a scan that was cancelled or replaced are dropped
+        if scan is not self.scan:
+            return
+        done = error = None
+        try:
+            for _ in range(POLL_MESSAGES):
+                kind, *message = scan.queue.get_nowait()
+                if kind == "partitions":
+                    scan.total = message[0]
+                elif kind == "volume":
+                    self.show_volume(scan, *message)
+                elif kind == "entries":
+                    self.add_volume_entries(*message)
+                elif kind == "loaded":
+                    self.finish_volume(*message)
+                    scan.loaded += 1
+                elif kind == "fingerprint":
+                    self.set_fingerprint(*message)
+                elif kind == "patch":
+                    self.patch_changed(*message)
+                elif kind == "stale":
+                    scan.stale = message[0]
+                elif kind == "reload":
+                    scan.reload = True
+                else:
+                    done, error = True, message[0]
+                    break
+        except queue.Empty:
+            pass
+        if done:
+            self.finish_scan(scan, error)
+            return
+        if scan.expected:
+            self.progress_bar.config(mode='determinate', maximum=max(scan.expected, scan.bytes), value=scan.bytes)
+        else:
+            # Nothing tells how much is left
+            self.progress_bar.config(mode='indeterminate')
+            self.progress_bar.step()
+        if scan.total:
+            self.progress_label.config(text=f"Read {scan.loaded} of {scan.total} volumes, "
+                                            f"{scan.records:,} records, {self.format_size(scan.bytes)}")
+        self.root.after(POLL_INTERVAL, self.poll_scan, scan)
+
+    def show_volume(self, scan, number, volume, root, listing):
+        """Add a volume as soon as it is opened, its root goes where its partition is on the disk."""
+        # Whether it was read up front is known once all of it is in
+        self.volumes[root.id] = (volume, False)
+        if listing is not None:
+            self.listings[volume] = listing
+        self.add_volume_entries([root])
+        index = bisect.bisect(scan.shown, number)
+        scan.shown.insert(index, number)
+        self.add_entry('', root, index)
+
+    def add_volume_entries(self, entries):
+        """Add entries of a volume still being read, folders get their size once all of it is."""
+        self.entry_dict.update((entry.id, entry) for entry in entries)
+        arrived = {}
+        for entry in entries:
+            if entry.is_folder:
+                entry.size = None
+            self.sizes.add(entry.id, entry.parentId, entry.size, entry.is_folder, entry.loader is None)
+            arrived.setdefault(entry.parentId, []).append(entry)
+        for parent_id, children in arrived.items():
+            if parent_id is None or not self.tree.exists(parent_id):
+                continue
+            shown = self.tree.get_children(parent_id)
+            if not shown:
+                # Shown before anything below it was read, it can be expanded now
+                self.tree.insert(parent_id, 'end')
+            elif not (len(shown) == 1 and not self.tree.item(shown[0], 'values')):
+                self.place_children(parent_id, children)
+
+    def finish_volume(self, root_id, sizes, full):
+        """Give the entries of a volume that was read the sizes they were read with, and sum up the folders left."""
+        self.sizes.set_sizes(sizes)
+        self.sizes.aggregate([root_id])
+        for entry_id, size in sizes.items():
+            entry = self.entry_dict.get(entry_id)
+            if entry is not None:
+                entry.size = self.sizes.get_size(entry_id) if entry.is_folder else size
+        self.volumes[root_id] = (self.volumes[root_id][0], full)
+
+    def finish_scan(self, scan, error):
+        self.scan = None
+        self.progress_frame.pack_forget()
+        if error is not None:
+            messagebox.showerror("Loading Error", f"An error occurred while reading the disk:\n{str(error)}")
+            return
+        if scan.reload:
+            # The changes could not be patched in, the disk is read again
+            self.load_disk_data(validate=True, notify=scan.notify)
+            return
+        if scan.stale:
+            # What was browsed of them is not saved over the disk's new state
+            self.listings = {volume: listing for volume, listing in self.listings.items() if listing[0] not in scan.stale}
+            self.load_disk_data(notify=scan.notify)
+            return
+        if scan.refreshed is not None:
+            self.volumes = scan.refreshed
+        if scan.notify:
+            messagebox.showinfo("Refresh Complete", "Data has been refreshed successfully")
+
+    def cancel_scan(self):
+        """Stop the read in the background, the volumes already shown stay browsable."""
+        if self.scan is None:
+            return
+        self.scan.cancelled.set()
+        self.scan = None
+        self.progress_frame.pack_forget()
+
+    def close(self):
+        """Stop reading, save what was browsed and close the window."""
+        self.cancel_scan()
+        self.save_listings()
+        self.root.destroy()
+
+    def validate_snapshots(self, unverified):
+        """Compare volumes shown from a snapshot with the disk, returns the keys of those that changed and drops their snapshots."""
+        stale = []
+        for key, get_fingerprint in unverified:
+            fingerprint = self.read_fingerprint(get_fingerprint)
+            if fingerprint is None or fingerprint != self.snapshot.fingerprint(key):
+                self.snapshot.discard(key)
+                stale.append(key)
+        return stale
+
+    def read_fingerprint(self, get_fingerprint):
+        # A volume whose fingerprint cannot be read is neither trusted from a snapshot nor saved to one
+        try:
+            return get_fingerprint()
+        except Exception:
+            return None
+
+    def open_snapshot(self):
+        if SNAPSHOT_PATH is None:
+            return None
+        try:
+            return Snapshot(SNAPSHOT_PATH)
+        except (OSError, sqlite3.Error):
+            return None
+
+    def load_snapshot(self, key):
+        if self.snapshot is None:
+            return None
+        return self.snapshot.load(key)
+
+    def save_snapshot(self, key, fingerprint, rows):
+        if self.snapshot is not None and fingerprint is not None:
+            self.snapshot.save(key, fingerprint, rows)
+
+    def reset_volumes(self):
+        self.save_listings()
+        # Folders loaded lazily keep reading from the device, so it stays open until the next refresh
+        if self.device is not None:
+            self.device.close()
+            self.device = None
+        if self.snapshot is None:
+            self.snapshot = self.open_snapshot()
+        self.volumes = {}
+
+    def find_location(self, location):
+        # Without an explicit drive or image path, use the removable drive reported by WMI
+        if location is None:
+            import wmi
+            c = wmi.WMI()
+            for disk in c.Win32_DiskDrive():
+                if disk.MediaType == "Removable Media":
+                    location = disk.DeviceID
+        return location
+
+    def read_volumes(self, partitions, device, scan):
+        """Read every partition in a job of its own, returns the (key, fingerprint function) of those shown from a snapshot.
+
+        The jobs share device, its block cache keeps what one of them read for the others.
+        """
+        with ThreadPoolExecutor(max(1, len(partitions))) as executor:
+            jobs = [executor.submit(self.read_volume, partition, number, device, scan)
+                    for number, partition in enumerate(partitions, 1)]
+            try:
+                return [unverified for unverified in (job.result() for job in as_completed(jobs)) if unverified is not None]
+            except BaseException:
+                # The other jobs stop at their next progress report instead of being waited for
+                scan.cancelled.set()
+                raise
+
+    def read_volume(self, partition, number, device, scan):
+        """Job reading one volume with ids numbered under number, it is handed to the window as it is read."""
+        scan.report(0, 0)
+        if partition.type == "NTFS":
+            volume = NTFS(partition, MFT_WORKERS, browse=True, namespace=number)
+            volume.progress = scan.report
+            unverified = self.read_ntfs_volume(scan, number, volume)
+        else:
+            volume = FAT32(partition.starting_sector, device, namespace=number)
+            volume.progress = scan.report
+            unverified = self.read_fat32_volume(scan, number, volume)
+        # Folders opened later are read on the window's thread, not as part of this read
+        volume.progress = None
+        return unverified
+
+    def send_volume(self, scan, number, volume, entries, listing=None):
+        """Hand the entries of a volume to the window, its root first and the rest a batch at a time."""
+        root = entries[0]
+        sizes = {entry.id: entry.size for entry in entries}
+        scan.queue.put(("volume", number, volume, root, listing))
+        for start in range(1, len(entries), ENTRY_BATCH):
+            batch = entries[start:start + ENTRY_BATCH]
+            scan.report(len(batch), 0)
+            scan.queue.put(("entries", batch))
+        scan.queue.put(("loaded", root.id, sizes, all(entry.loader is None for entry in entries)))
+
+    def read_ntfs_volume(self, scan, number, volume):
+        """Hand an NTFS volume to the window, returns its (key, fingerprint function) when it came from a snapshot."""
+        key = volume.get_identity()
+        rows = self.load_snapshot(key)
+        if rows is not None:
+            list_file = volume.from_snapshot(rows)
+            listing = [key, self.snapshot.fingerprint(key), list_file, False]
+            self.send_volume(scan, number, volume, self.ntfs_entries(volume, list_file, True), listing)
+            volume.record_journal_position()
+            return key, volume.get_fingerprint
+        if LAZY_LOADING:
+            list_file = [volume.get_root()]
+            listing = self.start_listing(key, list_file)
+            self.send_volume(scan, number, volume, self.ntfs_entries(volume, list_file, True), listing)
+            # Folders are listed after this, the first refresh only has to replay what the journal saw since
+            volume.record_journal_position()
+            self.send_fingerprint(scan, volume, listing, volume.get_fingerprint)
+            return None
+        # Taken before the scan, a change made while scanning makes the snapshot stale rather than wrong
+        fingerprint = self.read_fingerprint(volume.get_fingerprint)
+        root = self.ntfs_entries(volume, [volume.get_root()], False)[0]
+        scan.queue.put(("volume", number, volume, root, None))
+        volume.record_journal_position()
+        # Records show up as each chunk of the MFT is parsed, folder sizes once all of it is
+        scan.expect(volume.number_of_entries * volume.record_size)
+        volume.read_master_file_table(lambda items: scan.queue.put(("entries", self.ntfs_entries(volume, items, False))))
+        list_file = volume.get_list_file()
+        self.save_snapshot(key, fingerprint, volume.to_snapshot(list_file))
+        scan.queue.put(("loaded", root.id, {item["ID"]: item["Size"] for item in list_file}, True))
+        return None
+
+    def ntfs_entries(self, volume, list_file, lazy):
         entries = []
-        usb = None
-        id_increase = 0
-
-        for disk in c.Win32_DiskDrive():
-            if disk.MediaType == "Removable Media":
-                usb = disk
-
-        fin = open(usb.DeviceID, "rb")
-        fin.read(446)
-
-        for i in range(4):
-            par = fin.read(16)
-            partition = Partition(par, usb.DeviceID, 0)
-            if partition.type == "NTFS":
-                main = NTFS(partition)
-                list_file = main.get_list_file()
-
-                for entry in list_file:
-                    entries.append(
-                        Entry(entry["ID"], entry["Name"], entry["Is Folder"],
-                        entry["Parent ID"], entry["Size"], entry["Create Time"],
-                        entry["Modify Time"], entry["Data"], entry["Attribute"], "NTFS",
-                        entry["Total Size"])
-                        )
-                    
-            elif partition.type == "FAT32":
-                main = FAT32(partition.starting_sector, usb)
-                id_increase, arr = main.applyGUI(id_increase) 
-                for item in arr:
-                    entries.append(
-                        Entry(item["ID"], item["Name"], item["Flags"] == 16, item["Parent"], item["Size"], 
-                        item["Date Created"], item["Date Modified"], item["content"], item["Attribute"], 
-                        "FAT32", item["Total Size"])
-                        )
-            elif partition.type == "EBR":
-                ext = EBR(partition)
-                list_partition = ext.get_list_of_partition()
-                for p in list_partition:
-                    if p.type == "NTFS":
-                        main = NTFS(p)
-                        list_file = main.get_list_file()
-                        for entry in list_file:
-                            entries.append(
-                                Entry(entry["ID"], entry["Name"], entry["Is Folder"],
-                                entry["Parent ID"], entry["Size"], entry["Create Time"],
-                                entry["Modify Time"], entry["Data"], entry["Attribute"], "NTFS",
-                                entry["Total Size"])
-                            )
-                    elif p.type == "FAT32":
-                        main = FAT32(p.starting_sector, usb)
-                        id_increase, arr = main.applyGUI(id_increase) 
-                        for item in arr:
-                            entries.append(
-                                Entry(item["ID"], item["Name"], item["Flags"] == 16, item["Parent"], item["Size"], 
-                                item["Date Created"], item["Date Modified"], item["content"], item["Attribute"], 
-                                "FAT32", item["Total Size"])
-                                )
-        fin.close()
+        for item in list_file:
+            entry = Entry(item["ID"], item["Name"], item["Is Folder"],
+                item["Parent ID"], item["Size"], item["Create Time"],
+                item["Modify Time"], item["Data"], item["Attribute"], "NTFS",
+                item["Total Size"])
+            entry.locator = item["Record"]
+            if lazy and entry.is_folder and not item.get("Listed"):
+                entry.loader = partial(self.load_ntfs_directory, volume, item["Record"])
+            # Listed from a folder index, the size and times are read from the record once it is selected
+            if lazy and item["Attribute"] is not None:
+                entry.details = partial(volume.read_item, item["Record"])
+            entries.append(entry)
         return entries
 
+    def load_ntfs_directory(self, volume, record_id):
+        return self.ntfs_entries(volume, self.add_to_listing(volume, volume.list_directory(record_id)), True)
+
+    def read_fat32_volume(self, scan, number, volume):
+        """Hand a FAT32 volume to the window, returns its (key, fingerprint function) when it came from a snapshot."""
+        key = volume.getIdentity()
+        rows = self.load_snapshot(key)
+        if rows is not None:
+            _, items = volume.fromSnapshot(0, rows)
+            listing = [key, self.snapshot.fingerprint(key), items, False]
+            self.send_volume(scan, number, volume, self.fat32_entries(volume, items, True), listing)
+            return key, volume.getFingerprint
+        if LAZY_LOADING:
+            _, items = volume.applyGUI(0, True)
+            listing = self.start_listing(key, items)
+            self.send_volume(scan, number, volume, self.fat32_entries(volume, items, True), listing)
+            self.send_fingerprint(scan, volume, listing, volume.getFingerprint)
+            return None
+        fingerprint = self.read_fingerprint(volume.getFingerprint)
+        roots = []
+
+        def send(items):
+            # Directories show up as they are read, the root comes first on its own
+            entries = self.fat32_entries(volume, items, False)
+            if not roots:
+                roots.append(entries.pop(0))
+                scan.queue.put(("volume", number, volume, roots[0], None))
+            if entries:
+                scan.queue.put(("entries", entries))
+
+        _, items = volume.applyGUI(0, batch=send)
+        self.save_snapshot(key, fingerprint, volume.toSnapshot(items))
+        scan.queue.put(("loaded", roots[0].id, {item["ID"]: item["Size"] for item in items}, True))
+        return None
+
+    def fat32_entries(self, volume, items, lazy):
+        entries = []
+        for item in items:
+            entry = Entry(item["ID"], item["Name"], item["Flags"] == 16, item["Parent"], item["Size"], 
+                item["Date Created"], item["Date Modified"], item["content"], item["Attribute"], 
+                "FAT32", item["Total Size"])
+            entry.locator = item["Cluster"]
+            if lazy and entry.is_folder and not item.get("Listed"):
+                entry.loader = partial(self.load_fat32_directory, volume, item["Cluster"], item["ID"])
+            entries.append(entry)
+        return entries
+
+    def load_fat32_directory(self, volume, cluster, parent_id):
+        return self.fat32_entries(volume, self.add_to_listing(volume, volume.listDirectory(cluster, parent_id)), True)
+
+    def start_listing(self, key, items):
+        # The fingerprint is filled in once the volume is shown, see set_fingerprint
+        if self.snapshot is None:
+            return None
+        return [key, None, list(items), False]
+
+    def send_fingerprint(self, scan, volume, listing, get_fingerprint):
+        # Read after the volume is shown, it does not hold up browsing it
+        if listing is not None:
+            scan.queue.put(("fingerprint", volume, self.read_fingerprint(get_fingerprint)))
+
+    def set_fingerprint(self, volume, fingerprint):
+        listing = self.listings.get(volume)
+        if listing is None:
+            return
+        # Folders browsed before it was taken may predate it, a change made meanwhile would go unnoticed
+        if fingerprint is None or listing[3]:
+            del self.listings[volume]
+            return
+        listing[1] = fingerprint
+
+    def add_to_listing(self, volume, items):
+        listing = self.listings.get(volume)
+        if listing is not None:
+            listing[2].extend(items)
+            listing[3] = True
+        return items
+
+    def save_listings(self):
+        """Save what was browsed of the lazily read volumes, folders not opened yet are read when opened."""
+        listings, self.listings = self.listings, {}
+        for volume, (key, fingerprint, items, changed) in listings.items():
+            if not changed:
+                continue
+            # An NTFS file with several names in opened folders is kept once
+            items = list({item["ID"]: item for item in items}.values())
+            unread = set()
+            for item in items:
+                entry = self.entry_dict.get(item["ID"])
+                if entry is None or entry.loader is not None:
+                    unread.add(item["ID"])
+            try:
+                if isinstance(volume, NTFS):
+                    self.save_snapshot(key, fingerprint, volume.to_snapshot(items, unread))
+                else:
+                    self.save_snapshot(key, fingerprint, volume.toSnapshot(items, unread))
+            except sqlite3.Error:
+                continue
+
 if __name__ == "__main__":
     root = tk.Tk()
-    app = App(root, [])
+    # A disk image (.img/.dd) or drive path can be given instead of the removable drive
+    app = App(root, [], sys.argv[1] if len(sys.argv) > 1 else None)
     
-    new_entries = app.get_disk_data()
-    app.entries = new_entries
-    app.entry_dict = {entry.id: entry for entry in new_entries}
-    app.initial()
+    # Volumes shown from a snapshot are checked against the disk once they are all read
+    app.load_disk_data(validate=True)
 
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,130 @@
+"""List the NTFS and FAT32 volumes of a drive or disk image without the GUI, one JSON line per entry.
+
+    python scan.py disk.img > entries.jsonl
+
+NTFS sizes and dates are read from each entry's MFT record, --fast takes them from the directory
+index entries instead, which only hold what they were when the file's name was last written.
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime
+from helper.NTFS import NTFS, list_partitions
+from helper.FAT32 import FAT32
+from helper.device import open_device
+
+# Same as the GUI and the NTFS parser show dates
+DATE_FORMAT = "%A, %B %d, %Y, %I:%M:%S %p"
+
+def format_date(date):
+    if isinstance(date, datetime):
+        return date.strftime(DATE_FORMAT)
+    return date
+
+def iter_ntfs(volume, full=False):
+    """Yield (item, path) for every entry of an NTFS volume, read folder by folder through the directory indexes."""
+    root = volume.get_root()
+    yield root, root["Name"] or ""
+    stack = [(root["Record"], root["Name"] or "")]
+    seen = {root["Record"]}
+    while stack:
+        record_id, path = stack.pop()
+        for item in volume.list_directory(record_id, full):
+            item_path = path + "/" + item["Name"]
+            yield item, item_path
+            # A damaged index could point back at a folder above
+            if item["Is Folder"] and item["Record"] not in seen:
+                seen.add(item["Record"])
+                stack.append((item["Record"], item_path))
+
+def iter_fat32(volume):
+    """Yield (item, path) for every entry of a FAT32 volume, read directory by directory."""
+    _, (root,) = volume.applyGUI(0, True)
+    yield root, root["Name"] or ""
+    stack = [(root["Cluster"], root["ID"], root["Name"] or "")]
+    seen = {root["Cluster"]}
+    while stack:
+        cluster, parent_id, path = stack.pop()
+        for item in volume.listDirectory(cluster, parent_id):
+            item_path = path + "/" + item["Name"]
+            yield item, item_path
+            if item["Flags"] & 0x10 and item["Cluster"] not in seen:
+                seen.add(item["Cluster"])
+                stack.append((item["Cluster"], item["ID"], item_path))
+        # A listed directory is not looked up again, so its parsed entries are not kept
+        volume.DET.pop(cluster, None)
+
+def iter_volume(partition, device, number, full=False):
+    """Yield one row per entry of the volume on partition, ids are numbered under number like the GUI does."""
+    if partition.type == "NTFS":
+        volume = NTFS(partition, browse=True, namespace=number)
+        for item, path in iter_ntfs(volume, full):
+            yield {
+                "volume": number,
+                "file_system": "NTFS",
+                "id": item["ID"],
+                "parent": item["Parent ID"],
+                "path": path,
+                "name": item["Name"],
+                "folder": item["Is Folder"],
+                "size": item["Size"],
+                "created": format_date(item["Create Time"]),
+                "modified": format_date(item["Modify Time"]),
+                "attributes": item["Attribute"],
+            }
+    else:
+        volume = FAT32(partition.starting_sector, device, namespace=number)
+        for item, path in iter_fat32(volume):
+            yield {
+                "volume": number,
+                "file_system": "FAT32",
+                "id": item["ID"],
+                "parent": item["Parent"],
+                "path": path,
+                "name": item["Name"],
+                "folder": bool(item["Flags"] & 0x10),
+                "size": item["Size"],
+                "created": format_date(item["Date Created"]),
+                "modified": format_date(item["Date Modified"]),
+                "attributes": item["Attribute"],
+            }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="List the files of the NTFS and FAT32 volumes of a drive or disk image as JSON lines.")
+    parser.add_argument("location", help="disk image (.img/.dd) or drive path such as \\\\.\\PHYSICALDRIVE1")
+    parser.add_argument("--fast", action="store_true", help="take NTFS sizes and dates from the directory index entries, which can be out of date, instead of each entry's MFT record")
+    args = parser.parse_args(argv)
+
+    try:
+        device = open_device(args.location)
+    except OSError as error:
+        print(f"{args.location}: {error}", file=sys.stderr)
+        return 1
+    failed = False
+    try:
+        with device:
+            for number, partition in enumerate(list_partitions(device), 1):
+                # Folder sizes would need the whole volume first, entries are written as soon as they are read instead
+                rows = iter_volume(partition, device, number, not args.fast)
+                while True:
+                    # Only reading the volume is guarded, a failed write stops the whole listing
+                    try:
+                        row = next(rows, None)
+                    except Exception as error:
+                        # A damaged volume should not stop the others, or the next image of a batch
+                        print(f"{args.location}: partition {number}: {error}", file=sys.stderr)
+                        failed = True
+                        break
+                    if row is None:
+                        break
+                    sys.stdout.write(json.dumps(row, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+    except BrokenPipeError:
+        # The reader is gone (| head), what is still buffered goes to devnull instead of failing again at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())